@@ -568,6 +568,10 @@ class imodel(model):
 
         if self.confidential:
             return False
+
+        # the data saved by model.saveData is stored by columns in tdata.npz
+        if os.path.isfile (self.vpath+'/tdata.npz'):
+            return model.loadData (self)
         
         if not os.path.isfile (self.vpath+'/tdata.pkl'):
             return False
@@ -51,6 +51,13 @@ from model_validation import *  #JC
 from scale import center, scale
 from qualit import *
 from utils import updateProgress
+from modelfile import isModelFile, saveModelFile, loadModelFile
+
+# attributes of the model stored in the model file
+modelKeysRF = ['nobj', 'nvarx', 'quantitative', 'autoscale', 'estimators', 'features', 'random', 'class_weight',
+               'learning_curve', 'cv', 'n', 'p', 'mux', 'wgx', 'TP', 'TN', 'FP', 'FN',
+               'TPpred', 'TNpred', 'FPpred', 'FNpred', 'SDEC', 'R2', 'scoringR', 'Q2', 'SDEP', 'scoringP',
+               'OOBe', 'vpath']
 
 
 class RF:
@@ -102,53 +109,11 @@ class RF:
 
 
     def saveModel(self,filename):
-        """Saves the model to a binary file in numpy file and another in pkl format
+        """Saves the model to a binary file in numpy .npz format (see modelfile) and another in pkl format
 
         """
 
-        f = file(filename,'wb')
-
-        np.save(f,self.nobj)
-        np.save(f,self.nvarx)
-
-        np.save(f,self.quantitative)
-        np.save(f,self.autoscale)
-        np.save(f,self.estimators)
-        np.save(f,self.features)
-        np.save(f,self.random)
-        np.save(f,self.class_weight)
-        np.save(f,self.learning_curve)
-        np.save(f,self.cv)
-        np.save(f,self.n)
-        np.save(f,self.p)
-
-
-
-        np.save(f,self.mux)
-        np.save(f,self.wgx)
-
-        np.save(f,self.TP)
-        np.save(f,self.TN)
-        np.save(f,self.FP)
-        np.save(f,self.FN)
-
-        np.save(f,self.TPpred)
-        np.save(f,self.TNpred)
-        np.save(f,self.FPpred)
-        np.save(f,self.FNpred)
-
-        np.save(f,self.SDEC)
-        np.save(f,self.R2)
-        np.save(f, self.scoringR)
-        np.save(f, self.Q2)
-        np.save(f, self.SDEP)
-        np.save(f, self.scoringP)
-
-        np.save(f,self.OOBe)
-
-        np.save(f,self.vpath)
-
-        f.close()
+        saveModelFile (filename, 'RF', dict([(key, getattr(self,key)) for key in modelKeysRF]))
 
         # the classifier cannot be saved with numpy
         joblib.dump(self.clf, os.path.dirname(filename)+'/clasifier.pkl')
@@ -156,6 +121,22 @@ class RF:
 
     def loadModel(self,filename):
         """Loads the model from two files, one in numpy and another in pkl format
+
+           Numpy files written by older versions, containing a sequence of .npy records, are also supported
+        """
+
+        if isModelFile (filename):
+            m = loadModelFile (filename, 'RF')
+            for key in modelKeysRF:
+                setattr(self, key, m[key])
+        else:
+            self.loadModelLegacy (filename)
+
+        # the classifier cannot be loaded with numpy
+        self.clf = joblib.load(os.path.dirname(filename)+'/clasifier.pkl')
+
+    def loadModelLegacy(self,filename):
+        """Loads the model from a numpy file written by older versions
         """
 
         f = file(filename,'rb')
@@ -200,9 +181,6 @@ class RF:
 
         f.close()
 
-        # the classifier cannot be loaded with numpy
-        self.clf = joblib.load(os.path.dirname(filename)+'/clasifier.pkl')
-
 
     def build (self, X, Y, quantitative=False, autoscale=False,
                nestimators=0, features='', random=False, tune=False, class_weight="balanced",
@@ -506,6 +484,25 @@ class RF:
 
         return (Yp)
 
+    def projectBatch (self, Xb):
+        """ Uses the X matrix provided as argument (nobj x nvarx) to predict Y for all the objects
+            in a single call to the classifier
+        """
+
+        if self.clf == None:
+            print 'failed to load clasifier'
+            return
+
+        Xb = np.array(Xb, dtype=np.float64, ndmin=2)
+
+        if self.autoscale:
+            Xb = Xb-self.mux
+            Xb = Xb*self.wgx
+
+        Yp = self.clf.predict(Xb)
+
+        return (Yp)
+
 
     def optimize (self, X, Y ):
         """ Optimizes the number of trees (estimators) and max features used (features)
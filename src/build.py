@@ -44,10 +44,44 @@ def build (endpoint, molecules, model, verID, loc):
     if loc!=None:
         va += '/local%0.4d' % loc
 
+    # copy model to sandbox, either from argument or from version
+    if model:
+        shutil.copy (model,va+'/imodel.py')
+    else:
+        if vv != va:
+            shutil.copy (vv+'/imodel.py',va)
+    
+    # load model
+    try:
+        sys.path.append(va)
+        from imodel import imodel
+        model = imodel (va)
+    except:
+        return (False, 'unable to load imodel')
+
+    if not model:
+        return (False, 'unable to load imodel')
+
     # copy training set to sandbox, either from argument or from version
     if molecules:
 
-        cleanSandbox(va)
+        # incremental builds reuse the data extracted from the previous series (see model.buildWorkflow)
+        keep = []
+        if model.buildIncremental:
+            keep = ['tstruct.sdf', 'tdata.npz']
+
+        cleanSandbox(va, keep)
+
+        # if the sandbox contains no data, the series is compared with that of the last published version
+        if keep and loc==None and not os.path.isfile(va+'/tdata.npz'):
+            if verID!=None:
+                vp = vv
+            else:
+                vp = lastVersion (endpoint, -1)
+            if vp and vp != va and os.path.isfile(vp+'/tdata.npz'):
+                for i in keep:
+                    if os.path.isfile(vp+'/'+i):
+                        shutil.copy(vp+'/'+i,va)
         
         try:
             shutil.copy (molecules,va+'/training.sdf')
@@ -61,30 +95,15 @@ def build (endpoint, molecules, model, verID, loc):
             
             files = ['/training.sdf',
                      '/tstruct.sdf',
-                     '/tdata.pkl']
+                     '/tdata.npz',
+                     '/tdata.pkl',
+                     '/tindex.pkl']
             for i in files:
                 if os.path.isfile(vv+i):
                     shutil.copy(vv+i,va)
                     
             ##shutil.copy (vv+'/training.sdf',va)
 
-    # copy model to sandbox, either from argument or from version
-    if model:
-        shutil.copy (model,va+'/imodel.py')
-    else:
-        if vv != va:
-            shutil.copy (vv+'/imodel.py',va)
-    
-    # load model
-    try:
-        sys.path.append(va)
-        from imodel import imodel
-        model = imodel (va)
-    except:
-        return (False, 'unable to load imodel')
-
-    if not model:
-        return (False, 'unable to load imodel')
 ##        sys.path.append(va)
 ##        from imodel import imodel
 ##        model = imodel (va)
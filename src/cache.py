@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+##    Description    eTOXlab persistent cache
+##
+##    Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+##
+##    Copyright 2013 Manuel Pastor
+##
+##    This file is part of eTOXlab.
+##
+##    eTOXlab is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation version 3.
+##
+##    eTOXlab is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with eTOXlab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+
+from utils import removefile
+
+class cache:
+    """Persistent key-value store on disk, shared by all the models (endpoints and versions) of the host
+
+       Every value is stored in a separate file, named after its key. When the total size exceeds the
+       limit, the entries not used for the longest time are removed
+    """
+
+    def __init__ (self, path, maxSize):
+        """path    : directory where the values are stored, created if it does not exists
+           maxSize : maximum size of the cache in MB
+        """
+        self.path = path
+        self.maxSize = maxSize*1048576
+        self.nput = 0
+        self.checkEvery = 100        # number of values stored between checks of the cache size
+
+        if not os.path.isdir(path):
+            try:
+                os.makedirs (path)
+            except OSError:
+                pass                 # created by another process
+
+    def key (self, *items):
+        """Returns a key built from the text representation of all the items
+        """
+        return hashlib.sha1('\n'.join([repr(i) for i in items])).hexdigest()
+
+    def getFileName (self, key):
+        return os.path.join (self.path, key[:2], key)
+
+    def get (self, key):
+        """Returns the value stored for key, or None if not found
+        """
+        fname = self.getFileName (key)
+
+        try:
+            f = open (fname,'rb')
+            value = pickle.load(f)
+            f.close()
+        except:
+            return None
+
+        # record the last use, for evicting the least recently used entries
+        try:
+            os.utime (fname, None)
+        except OSError:
+            pass
+
+        return value
+
+    def put (self, key, value):
+        """Stores value for key. The value is written in a temporary file which is renamed at the end, so
+           other processes never read incomplete values
+        """
+        fname = self.getFileName (key)
+        dname = os.path.dirname (fname)
+
+        try:
+            if not os.path.isdir(dname):
+                os.makedirs (dname)
+        except OSError:
+            pass
+
+        try:
+            fd, tname = tempfile.mkstemp (dir=dname)
+            f = os.fdopen (fd,'wb')
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            f.close()
+            os.rename (tname, fname)
+        except:
+            return False
+
+        self.nput += 1
+        if self.nput % self.checkEvery == 0:
+            self.evict()
+
+        return True
+
+    def evict (self):
+        """Removes the least recently used entries until the size of the cache is below 90% of the limit
+        """
+        entries = []
+        size = 0
+        for root, dirs, files in os.walk (self.path):
+            for fi in files:
+                fname = os.path.join (root, fi)
+                try:
+                    st = os.stat (fname)
+                except OSError:
+                    continue
+                entries.append ((st.st_mtime, st.st_size, fname))
+                size += st.st_size
+
+        if size <= self.maxSize:
+            return
+
+        entries.sort()
+        for mtime, fsize, fname in entries:
+            if size <= 0.9*self.maxSize:
+                break
+            removefile (fname)
+            size -= fsize
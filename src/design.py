@@ -93,16 +93,20 @@ def generateDesignFFD (nvarx, ratio):
     for i in range (R):
         lineDis[:,i]=Dis[:,i]
     
-    for w in range (ncomb):
-        disw = Dis[w,:]
-        # the next columns are generated using the Gen indexes
-        for h in range (nvarx-R):
-            nneg = 0
-            gg = G[NG-h,:]
-            for t in range (1,R+1):
-                if disw[gg[t]-1] < 0 : nneg += 1   ## gg indexes must be decreased (-1) because now Dis use C style indexing
-                #if disw[gg[t-1]] < 0 : nneg += 1   ## C style indexing
-            if nneg%2 : lineDis[w,h+R] = -1
+    # the next columns are generated using the Gen indexes: column h+R is negative when the number of
+    # negative values in the Dis columns indexed by G[NG-h] is odd. These counts are obtained for all
+    # the lines at once, multiplying the negative values of Dis by an indicator matrix of the indexes
+    nextCols = nvarx-R
+    if nextCols > 0:
+        gg = G[NG-np.arange(nextCols),1:R+1]-1   ## gg indexes must be decreased (-1) because now Dis use C style indexing
+
+        Ind = np.zeros((R,nextCols),dtype=np.int)
+        for t in range (R):
+            valid = gg[:,t] >= 0                 ## index -1 points to the last column of Dis, which is never negative
+            np.add.at(Ind, (gg[valid,t], np.nonzero(valid)[0]), 1)
+
+        nneg = np.dot((Dis[:,:R] < 0).astype(np.int), Ind)
+        lineDis[:,R:][nneg%2 == 1] = -1
     
     
 ##    for i in range (ncomb):
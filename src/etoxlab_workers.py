@@ -346,7 +346,9 @@ class buildLauncher:
             if version != '0' :
                 files = ['training.sdf',
                          'tstruct.sdf',
-                         'tdata.pkl']
+                         'tdata.npz',
+                         'tdata.pkl',
+                         'tindex.pkl']
                 try:
                     for i in files:
                         if os.path.isfile(origDir+i):
@@ -359,6 +361,16 @@ class buildLauncher:
                 tkMessageBox.showerror("Error Message", "No series found")
                 return
 
+        # for a new series, the data of the selected version is copied too, since incremental builds
+        # reuse it (build.py removes it otherwise)
+        elif series and version != '0':
+            for i in ['tstruct.sdf', 'tdata.npz']:
+                try:
+                    if os.path.isfile(origDir+i):
+                        shutil.copy(origDir+i,destDir)
+                except:
+                    pass
+
         # If 'model' starts with '<edited' the file imodel.py has been already copied. Else, copy it    
         if not model.startswith('<edited'):
             if version != '0' :
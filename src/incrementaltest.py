@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##    Description    eTOXlab component for checking incremental model builds
+##
+##    Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+##
+##    Copyright 2017 Manuel Pastor
+##
+##    This file is part of eTOXlab.
+##
+##    eTOXlab is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation version 3.
+##
+##    eTOXlab is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with eTOXlab.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import os
+import re
+import getopt
+import subprocess
+
+from utils import *
+
+def runBuild (endpoint, molecules, model):
+    """Runs build.py for the series molecules, with the model file "model" or, if None, the model
+       of the sandbox
+
+       Returns a tuple with the success and the output of the command
+    """
+
+    call = [sys.executable, wkd+'/build.py', '-e', endpoint, '-f', molecules]
+    if model:
+        call += ['-m', model]
+    else:
+        call += ['-v', '0']
+
+    try:
+        proc = subprocess.Popen (call, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+    except:
+        return (False, 'unable to run build.py')
+
+    if proc.returncode != 0:
+        return (False, 'build.py failed: '+output.strip().split('\n')[-1])
+
+    return (True, output)
+
+def incrementalTest (endpoint, molecules, model):
+    """Builds the model of the endpoint twice with the same series, running build.py as the users do, and
+       checks that the second build reuses the data extracted for all the compounds (see buildIncremental)
+    """
+
+    success, result = runBuild (endpoint, molecules, model)
+    if not success:
+        return (False, result)
+
+    va = sandVersion (endpoint)
+
+    try:
+        sys.path.append(va)
+        from imodel import imodel
+        if not imodel(va).buildIncremental:
+            return (False, 'the model must set buildIncremental to True')
+    except:
+        return (False, 'unable to load imodel')
+
+    # the model file is already in the sandbox
+    success, result = runBuild (endpoint, molecules, None)
+    if not success:
+        return (False, result)
+
+    counts = re.search ('incremental build: (\d+) compounds reused, (\d+) extracted', result)
+    if not counts:
+        return (False, 'the data of the previous series was not reused')
+
+    reused, extracted = int(counts.group(1)), int(counts.group(2))
+    if extracted or not reused:
+        return (False, '%d compounds reused, %d extracted again' % (reused, extracted))
+
+    return (True, '%d compounds reused' % reused)
+
+def usage ():
+    """Prints in the screen the command syntax and argument"""
+
+    print 'ERROR: incrementaltest -e endpoint -f filename.sdf [-m model.py]'
+
+def main ():
+
+    endpoint = None
+    mol = None
+    mod = None
+
+    try:
+       opts, args = getopt.getopt(sys.argv[1:], 'e:f:m:h')
+
+    except getopt.GetoptError:
+       writeError('Error. Arguments not recognized')
+       usage()
+       sys.exit(1)
+
+    if args:
+       writeError('Error. Arguments not recognized')
+       usage()
+       sys.exit(1)
+
+    if len( opts ) > 0:
+        for opt, arg in opts:
+            if opt in '-e':
+                endpoint = arg
+            elif opt in '-f':
+                mol = arg
+            elif opt in '-m':
+                mod = arg
+            elif opt in '-h':
+                usage()
+                sys.exit(0)
+
+    if (endpoint==None) or (mol==None):
+        usage()
+        sys.exit(1)
+
+    success, result = incrementalTest (endpoint, mol, mod)
+
+    if not success:
+        print '\nERROR:', result
+        sys.exit(1)
+
+    print result
+    sys.exit(0)
+
+if __name__ == '__main__':
+
+    main()
@@ -332,6 +332,8 @@ def exportEndpoint (endpoint):
         if os.path.isfile (wkd+'/'+endpoint+'/'+iversion+'/distiledPLS.txt'):
             tar.add(endpoint+'/'+iversion+'/imodel.py')
             tar.add(endpoint+'/'+iversion+'/distiledPLS.txt')
+            if os.path.isfile (wkd+'/'+endpoint+'/'+iversion+'/compiledPLS.npy'):
+                tar.add(endpoint+'/'+iversion+'/compiledPLS.npy')
             tar.add(endpoint+'/'+iversion+'/info.pkl')
             modconfY=True
         else:
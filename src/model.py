@@ -34,6 +34,10 @@ import cPickle as pickle
 import time
 import urllib2
 import glob
+import tempfile
+import hashlib
+import multiprocessing
+from itertools import chain, islice
 
 import matplotlib
 from pylab import *
@@ -44,18 +48,67 @@ import numpy as np
 from pls import pls
 from pca import pca
 from RF import RF
+from model_validation import getCrossVal
 from StringIO import StringIO
 from utils import removefile
 from utils import randomName
 from utils import updateProgress
 from utils import writeError
+from utils import getErrorFile
+from utils import setErrorFile
+from utils import appendFile
 from utils import wkd
+from utils import readSDF
+from utils import scratchDir
+from utils import enumerateChunks
+from utils import callTimeout
+from molecule import molecule
+from molecule import asMolecule
+from cache import cache
+from padel import padel
+from modelfile import isModelFile, saveModelFile, loadModelFile
+from tdatastore import tdatastore, storeRows, loadStore
 
 from rdkit import Chem
 from rdkit import RDLogger
 from standardise import standardise
 from qualit import *
 from rdkit.Chem import Descriptors
+from sklearn.neighbors import KDTree
+
+##################################################################
+##    PARALLEL PROCESSING
+##################################################################
+
+workerModel = None   # model used by the worker processes, inherited from the parent process
+
+def initWorker (scratch):
+    """Initializes a worker process, giving it a private scratch directory inside "scratch" which is
+       also used as working directory, so the files written by the external programs are not shared.
+       The errors are also written to a private log, in the same directory
+    """
+    workerModel.scratch = tempfile.mkdtemp (dir=scratch)
+    os.chdir (workerModel.scratch)
+    setErrorFile (os.path.join (workerModel.scratch, 'error.log'))
+
+def runWorker (args):
+    """Runs in a worker process the method of the model with name args[0], using the arguments in args[1]
+
+       Returns a tuple with the result and the text of the errors written during the call, which the
+       parent process adds to its error log together with the result (see runSerialOrParallel)
+    """
+    method, margs = args
+
+    removefile (getErrorFile())
+    result = getattr(workerModel, method)(*margs)
+
+    errors = ''
+    if os.path.isfile (getErrorFile()):
+        f = open (getErrorFile(),'r')
+        errors = f.read()
+        f.close()
+
+    return (result, errors)
 
 
 
@@ -65,6 +118,10 @@ class model:
 
         self.vpath = vpath
         self.tdata = []
+        self.tdigest = []        # digest of the SDFile record of every compound in tdata
+        self.tindex = None       # InChiKey index of tdata, used for identity checks
+        self.scratch = None      # private directory for the temporary files of a workflow run
+        self.checkpoint = None   # state of the last checkpoint saved while extracting the training series
 
         ##
         ## General settings
@@ -74,6 +131,8 @@ class model:
         self.confidential = False
         self.identity = False
         self.experimental = False
+        self.buildIncremental = False
+        self.buildCheckpoint = 1000
         self.SDFileName = ''
         self.SDFileActivity = ''
         self.SDFileExperimental = ''
@@ -128,14 +187,52 @@ class model:
         self.selVarLV = None
         #self.selVarCV = None
         self.selVarRun = None
+        self.selVarStop = 0
         self.selVarMask = None
 
+        ##
+        ## Prediction context. Model artifacts are loaded only once per
+        ## prediction workflow and reused for every compound
+        ##
+        self.predPLS = None
+        self.predRF = None
+        self.predADAN = None
+        self.predTScores = None
+        self.predChunk = 250         # number of compounds projected together in the model
+
+        ##
+        ## Parallel processing settings
+        ##
+        self.numWorkers = 1          # number of processes used to normalize and process the compounds
+        self.toolChunk = 1           # number of compounds processed in every call to the external programs
+        self.mdBatch = {}            # MD computed by computeMDBatch, by molecule name
+
+        ##
+        ## Cache settings. Results of the external programs are stored in a cache shared by all the models
+        ##
+        self.cachePath = '/var/tmp/etoxlab-cache'
+        self.cacheSize = 1000        # maximum size of every cache in MB
+        self.cacheMD = False         # cache the MD computed by pentacle, padel and adriana
+        self.cacheNorm = False       # cache the structures normalized by standardise, blabber and corina
+        self.mdCache = None
+        self.normCache = None
+
+        ##
+        ## Timeouts of the external programs, in seconds per compound. None waits forever
+        ##
+        self.mokaTimeout = None
+        self.corinaTimeout = None
+        self.adrianaTimeout = None
+        self.pentacleTimeout = None
+        self.padelTimeout = None
+
         ##
         ## Path to external programs
         ##
         self.mokaPath = None
         self.padelPath = None
         self.padelURL = None
+        self.padelClient = None      # client of the PaDEL web service, created when needed (see getPadelClient)
         self.pentaclePath = None
         self.adrianaPath = None
         self.corinaPath = None
@@ -341,6 +438,20 @@ class model:
         if self.confidential:
             return False
 
+        # the data is stored by columns in tdata.npz, and the MD matrix is memory-mapped
+        if os.path.isfile (self.vpath+'/tdata.npz'):
+            try:
+                settings, store = loadStore (self.vpath+'/tdata.npz')
+            except:
+                return False
+
+            if not self.checkSettings (StringIO(settings)):
+                return False
+
+            self.tdata = store
+            return True
+
+        # models built by older versions pickled the list of tuples in tdata.pkl
         if not os.path.isfile (self.vpath+'/tdata.pkl'):
             return False
 
@@ -349,72 +460,116 @@ class model:
         except:
             return False
 
-        norm = pickle.load(f)
-        if norm != self.norm:
+        if not self.checkSettings (f):
+            f.close()
             return False
 
-        if norm:
-            normStand = pickle.load(f)
-            if normStand != self.normStand:
-                return False
+        self.tdata = pickle.load(f)
+        f.close()
+
+        return True
+
+    def saveData (self):
+        """Saves all model settings in file tdata.npz, so they can be compared with actual model settings in future runs,
+           together with the data extracted from the training series, stored by columns (see tdatastore)
+
+           Please note that this method does not intend to save information for setting up the model. This is carried out
+           by the __init__ method
+        """
+
+        if self.confidential:
+            return
+
+        settings = StringIO()
+        self.saveSettings (settings)
+
+        digests = None
+        if len(self.tdigest) == len(self.tdata):
+            digests = self.tdigest
+
+        store = storeRows (self.tdata, digests)
+
+        try:
+            store.save (self.vpath+'/tdata.npz', settings.getvalue())
+        except:
+            return
+
+        self.tdata = store
+
+        removefile (self.vpath+'/tdata.pkl')   # written by older versions
+
+        # remove variables that might not be applicable any longer, like FFD excluded variables
+        removefile (self.vpath+'/ffdexcluded.pkl')
+
+        removefile (self.vpath+'/view-property.pkl')
+        removefile (self.vpath+'/view-model-pca.pkl')
+        removefile (self.vpath+'/view-background-pca.txt')
+        removefile (self.vpath+'/view-background-property.txt')
+
+        self.saveIdentityIndex ()
+
 
-            normNeutr = pickle.load(f)
-            if normNeutr != self.normNeutr:
+    def checkSettings (self, f):
+        """Reads the model settings stored at the beginning of the open file f and compares them with
+           the current settings. In case of any disagreement, a False is returned
+        """
+
+        try:
+            norm = pickle.load(f)
+            if norm != self.norm:
                 return False
 
-            if normNeutr:
-                normNeutrMethod = pickle.load(f)
-                if normNeutrMethod != self.normNeutrMethod:
+            if norm:
+                normStand = pickle.load(f)
+                if normStand != self.normStand:
                     return False
 
-                normNeutr_pH = pickle.load(f)
-                if normNeutr_pH != self.normNeutr_pH:
+                normNeutr = pickle.load(f)
+                if normNeutr != self.normNeutr:
                     return False
 
-            norm3D = pickle.load(f)
-            if norm3D != self.norm3D:
-                return False
+                if normNeutr:
+                    normNeutrMethod = pickle.load(f)
+                    if normNeutrMethod != self.normNeutrMethod:
+                        return False
 
-        MD = pickle.load(f)
+                    normNeutr_pH = pickle.load(f)
+                    if normNeutr_pH != self.normNeutr_pH:
+                        return False
 
-        if MD != self.MD:
-            return False
+                norm3D = pickle.load(f)
+                if norm3D != self.norm3D:
+                    return False
 
-        if 'pentacle' in MD:
-            pentacleProbes = pickle.load(f)
+            MD = pickle.load(f)
 
-            if pentacleProbes != self.pentacleProbes:
+            if MD != self.MD:
                 return False
 
-            pentacleOthers = pickle.load(f)
-            if pentacleOthers != self.pentacleOthers:
-                return False
+            if 'pentacle' in MD:
+                pentacleProbes = pickle.load(f)
 
-        elif 'padel' in MD:
-            padelMD = pickle.load(f)
-            if padelMD != self.padelMD:
-                return False
+                if pentacleProbes != self.pentacleProbes:
+                    return False
 
-        self.tdata = pickle.load(f)
-        f.close()
+                pentacleOthers = pickle.load(f)
+                if pentacleOthers != self.pentacleOthers:
+                    return False
 
-        return True
+            elif 'padel' in MD:
+                padelMD = pickle.load(f)
+                if padelMD != self.padelMD:
+                    return False
+        except:
+            return False
 
-    def saveData (self):
-        """Saves all model settings in file tdata.pkl, so they can be compared with actual model settings in future runs
+        return True
 
-           Please note that this method does not intend to save information for setting up the model. This is carried out
-           by the __init__ method
+    def saveSettings (self, f):
+        """Writes the current model settings at the beginning of the open file f, so they can be
+           checked using checkSettings
         """
 
-        if self.confidential:
-            return
-
-        try:
-            f = open (self.vpath+'/tdata.pkl','wb')
-        except:
-            return
-
         pickle.dump(self.norm, f)
         if self.norm:
             pickle.dump(self.normStand, f)
@@ -431,18 +586,63 @@ class model:
         elif 'padel' in self.MD:
             pickle.dump(self.padelMD,f)
 
-        pickle.dump(self.tdata, f)
+    def getIdentityIndex (self, tdata):
+        """Returns a dictionary with the InChiKey of every compound in tdata as key and its activity as value.
+           When a compound is repeated in the series, the first one is used
+        """
 
-        # remove variables that might not be applicable any longer, like FFD excluded variables
-        removefile (self.vpath+'/ffdexcluded.pkl')
+        index = {}
+        for l in tdata:   # the InChi is the element 1 of the tuple and the Activity is the element 4
+            if l[1] and not l[1] in index:
+                index[l[1]] = l[4]
 
-        removefile (self.vpath+'/view-property.pkl')
-        removefile (self.vpath+'/view-model-pca.pkl')
-        removefile (self.vpath+'/view-background-pca.txt')
-        removefile (self.vpath+'/view-background-property.txt')
+        return index
+
+    def saveIdentityIndex (self):
+        """Saves the InChiKey index of the training series in file tindex.pkl, preceded by the model settings,
+           so the identity of the query compounds can be checked without loading the whole tdata.pkl
+        """
+
+        if self.confidential:
+            return
+
+        try:
+            f = open (self.vpath+'/tindex.pkl','wb')
+        except:
+            return
+
+        self.saveSettings (f)
+        pickle.dump(self.getIdentityIndex(self.tdata), f, pickle.HIGHEST_PROTOCOL)
 
         f.close()
 
+    def loadIdentityIndex (self):
+        """Loads the InChiKey index of the training series into self.tindex, used by checkIdentity
+
+           For models built before tindex.pkl was introduced, or when the index does not match the
+           current settings, the index is obtained from the data stored in tdata.pkl
+        """
+
+        self.tindex = None
+
+        if self.confidential:
+            return False
+
+        try:
+            f = open (self.vpath+'/tindex.pkl','rb')
+            if self.checkSettings (f):
+                self.tindex = pickle.load(f)
+            f.close()
+        except:
+            self.tindex = None
+
+        if self.tindex is None:
+            if not self.loadData ():
+                return False
+            self.tindex = self.getIdentityIndex (self.tdata)
+
+        return True
+
 
     def savePropertyData (self):
         """Saves visualization matrix of property data in file view-property.pkl
@@ -537,10 +737,11 @@ class model:
 
     def computeMDAdriana (self, mol, clean=True):
 
-        molr = randomName(20)+'.csv'
+        mol = asMolecule (mol)
+        molr = self.scratchFile (randomName(20)+'.csv')
 
         call = [self.adrianaPath+'adriana',
-                '-i', mol,
+                '-i', mol.getFile(),
                 '-o', molr,
                 self.adrianaPath+'adrianaFull.prj']   #TODO use diverse projects and select here
 
@@ -548,7 +749,7 @@ class model:
         stderrf = open (os.devnull, 'w')
 
         try:
-            retcode = subprocess.call(call,stdout=stdoutf,stderr=stderrf)
+            retcode = callTimeout (call, self.adrianaTimeout, stdoutf, stderrf)
         except:
             stdoutf.close()
             stderrf.close()
@@ -557,6 +758,10 @@ class model:
         stdoutf.close()
         stderrf.close()
 
+        if retcode is None:
+            removefile (molr)
+            return (False, 'AdrianaCode execution timeout')
+
         try:
             fpr = open (molr)
         except:
@@ -580,6 +785,68 @@ class model:
 
         return (True,md)
 
+    def computeMDAdrianaBatch (self, mols):
+        """ Computes Adriana Molecular Descriptors for all the compounds in list "mols" in a single call
+
+            Returns a list with a tuple like those returned by computeMDAdriana for every compound
+        """
+
+        fin, fout = self.batchFiles ()
+        self.writeBatch (fin, mols)
+
+        molr = self.scratchFile (randomName(20)+'.csv')
+
+        call = [self.adrianaPath+'adriana',
+                '-i', fin,
+                '-o', molr,
+                self.adrianaPath+'adrianaFull.prj']
+
+        stdoutf = open (os.devnull, 'w')
+        stderrf = open (os.devnull, 'w')
+
+        error = None
+        try:
+            retcode = callTimeout (call, self.adrianaTimeout and self.adrianaTimeout*len(mols), stdoutf, stderrf)
+        except:
+            error = 'AdrianaCode execution error'
+
+        stdoutf.close()
+        stderrf.close()
+
+        # the compound hanging the program is found processing the compounds one by one
+        if error is None and retcode is None:
+            removefile (fin)
+            removefile (molr)
+            return [self.computeMDAdriana (mol) for mol in mols]
+
+        lines = {}
+        if error is None:
+            lines = self.readBatchCSV (molr, len(mols), True)
+
+        removefile (fin)
+        removefile (molr)
+
+        results = []
+        for k in range(len(mols)):
+            if error:
+                results.append ((False, error))
+                continue
+
+            if k not in lines:
+                results.append ((False, 'Adriana results not found'))
+                continue
+
+            try:
+                md = np.genfromtxt(StringIO(lines[k]),delimiter=',')
+                md = np.nan_to_num(md)
+            except:
+                results.append ((False, 'Adriana results not complete'))
+                continue
+
+            results.append ((True, md))
+
+        return results
+
     def computeMDPentacle (self, mol, clean=True):
         """ Computes Pentacle Molecular Descriptors for compound "mol"
 
@@ -589,11 +856,17 @@ class model:
                An Error message (if False)
         """
 
+        mol = asMolecule (mol)
         molr = randomName(20)
 
-        t = open ('template-md','w')
+        # pentacle writes the results in the working directory, so it is run in the scratch directory
+        work = os.path.abspath (self.scratchFile ('.'))
+        template = os.path.join (work, 'template-md')
+        stdout = os.path.join (work, 'stdout.txt')
+
+        t = open (template,'w')
         t.write ('name '+molr+'\n')
-        t.write ('input_file '+mol+' sdf\n')
+        t.write ('input_file '+os.path.abspath(mol.getFile())+' sdf\n')
         t.write ('mif_computation grid\n')
         t.write ('mif_discretization amanda\n')
         t.write ('mif_encoding  macc2\n')
@@ -607,13 +880,13 @@ class model:
         t.close()
 
         call = [self.pentaclePath+'pentacle',
-                '-c','template-md']
+                '-c',template]
 
-        stdoutf = open ('stdout.txt','w')
+        stdoutf = open (stdout,'w')
         stderrf = open (os.devnull, 'w')
 
         try:
-            retcode = subprocess.call(call,stdout=stdoutf,stderr=stderrf)
+            retcode = callTimeout (call, self.pentacleTimeout, stdoutf, stderrf, work)
         except:
             removefile ( '/var/tmp/'+molr )
             removefile ( '/var/tmp/'+molr+'.ppf' )
@@ -627,8 +900,12 @@ class model:
         removefile ( '/var/tmp/'+molr )
         removefile ( '/var/tmp/'+molr+'.ppf' )
 
+        if retcode is None:
+            removefile (os.path.join (work, molr+'.csv'))
+            return (False, 'Pentacle execution timeout')
+
         try:
-            stdoutf = open('stdout.txt')
+            stdoutf = open(stdout)
         except:
             return (False, 'Pentacle std output not found')
 
@@ -639,7 +916,7 @@ class model:
         stdoutf.close()
 
         try:
-            fpr = open (molr+'.csv')
+            fpr = open (os.path.join (work, molr+'.csv'))
         except:
             return (False, 'Pentacle results not found')
 
@@ -656,35 +933,113 @@ class model:
             return (False,'error in Pentacle')
 
         if clean:
-            removefile (molr+'.csv')
-            removefile ('template-md')
-            removefile ('stdout.txt')
+            removefile (os.path.join (work, molr+'.csv'))
+            removefile (template)
+            removefile (stdout)
 
         return (True,md)
 
 
-    def computeMDPadelws (self, mol, clean=False):
-        """ Computes PaDEL Molecular Descriptors for compound "mol"
-
-            In this implementation we use PaDEL making calls to a web service
-            in the background to avoid startig up the Java VM again and again
+    def computeMDPentacleBatch (self, mols):
+        """ Computes Pentacle Molecular Descriptors for all the compounds in list "mols" in a single call
 
-            It returms a tuple that contains
-            1) True or False, indicating the success of the computation
-            2) A vector of floats (if True) with the PaDEL descriptors
-               An Error message (if False)
+            Returns a list with a tuple like those returned by computeMDPentacle for every compound
         """
+
+        fin, fout = self.batchFiles ()
+        self.writeBatch (fin, mols)
+
+        molr = randomName(20)
+
+        # pentacle writes the results in the working directory, so it is run in the scratch directory
+        work = os.path.abspath (self.scratchFile ('.'))
+        template = os.path.join (work, 'template-md')
+        stdout = os.path.join (work, 'stdout.txt')
+
+        t = open (template,'w')
+        t.write ('name '+molr+'\n')
+        t.write ('input_file '+os.path.abspath(fin)+' sdf\n')
+        t.write ('mif_computation grid\n')
+        t.write ('mif_discretization amanda\n')
+        t.write ('mif_encoding  macc2\n')
+        for key in self.pentacleOthers:
+            t.write (key+'\n')
+        for probe in self.pentacleProbes:
+            t.write ('probe '+probe+'\n')
+        t.write ('dynamic yes\n')
+        t.write ('export_data csv\n')
+
+        t.close()
+
+        call = [self.pentaclePath+'pentacle',
+                '-c',template]
+
+        stdoutf = open (stdout,'w')
+        stderrf = open (os.devnull, 'w')
+
+        error = None
         try:
-            shutil.rmtree('padel')
+            retcode = callTimeout (call, self.pentacleTimeout and self.pentacleTimeout*len(mols), stdoutf, stderrf, work)
         except:
-            pass
+            error = 'Pentacle execution error'
+
+        stdoutf.close()
+        stderrf.close()
+
+        removefile ( '/var/tmp/'+molr )
+        removefile ( '/var/tmp/'+molr+'.ppf' )
+
+        # the compound hanging the program is found processing the compounds one by one
+        if error is None and retcode is None:
+            removefile (fin)
+            removefile (os.path.join (work, molr+'.csv'))
+            return [self.computeMDPentacle (mol) for mol in mols]
+
+        # errors of individual compounds are reported in the standard output, but the failed compounds
+        # are identified because they are missing in the results
+        lines = {}
+        if error is None:
+            lines = self.readBatchCSV (os.path.join (work, molr+'.csv'), len(mols), False)
+
+        removefile (fin)
+        removefile (os.path.join (work, molr+'.csv'))
+        removefile (template)
+        removefile (stdout)
+
+        results = []
+        for k in range(len(mols)):
+            if error:
+                results.append ((False, error))
+                continue
+
+            if k not in lines or not len(lines[k]):
+                results.append ((False, 'error in Pentacle'))
+                continue
+
+            lfile = StringIO(lines[k])
+            md = np.loadtxt(lfile,delimiter=',')
+            lfile.close()
+
+            results.append ((True, md))
+
+        return results
+
+    def getPadelClient (self):
+        """ Returns the client of the PaDEL web service, or pool of services, defined in padelURL
+
+            The client keeps its connections open, so every process creates its own one
+        """
+        if self.padelClient is None or self.padelClient.pid != os.getpid():
+            self.padelClient = padel (self.padelURL)
 
-        os.mkdir ('padel')
-        shutil.copy (mol,'padel')
+        return self.padelClient
 
-        homepath = os.getcwd()
-        call = ['-dir', homepath+'/padel',
-                '-file',homepath+'/padel.txt']
+    def getPadelParams (self, padelDir, padelFile):
+        """ Returns the list of arguments of the PaDEL web service for computing the MD of the compounds
+            in directory padelDir, writting the results in file padelFile
+        """
+        call = ['-dir', padelDir,
+                '-file',padelFile]
 
         for key in self.padelMD:
             call.append (key)
@@ -703,23 +1058,38 @@ class model:
             call.append ('-descriptortypes')
             call.append (dfile)
 
-        params = "|".join(call)
-        try:
-            url = self.padelURL+params
-            req  = urllib2.Request(url)
-            resp = urllib2.urlopen(req)
-            the_page = resp.read()
-            #print the_page
-            retcode = 0
-        except urllib2.HTTPError as e:
-            return (False, 'PaDEL execution HTTPError' )
-        except urllib2.URLError as e:
-            return (False, 'PaDEL execution URLError' )
+        return call
+
+    def computeMDPadelws (self, mol, clean=False):
+        """ Computes PaDEL Molecular Descriptors for compound "mol"
+
+            In this implementation we use PaDEL making calls to a web service
+            in the background to avoid startig up the Java VM again and again
+
+            It returms a tuple that contains
+            1) True or False, indicating the success of the computation
+            2) A vector of floats (if True) with the PaDEL descriptors
+               An Error message (if False)
+        """
+        padelDir = os.path.abspath (self.scratchFile ('padel'))
+        padelFile = os.path.abspath (self.scratchFile ('padel.txt'))
+
+        try:
+            shutil.rmtree(padelDir)
         except:
-            return (True, 'PaDEL execution error' )
+            pass
+
+        os.mkdir (padelDir)
+        mol = asMolecule (mol)
+        mol.saveAs (os.path.join (padelDir, os.path.basename(mol.name)))
+
+        success, result = self.getPadelClient().compute (self.getPadelParams (padelDir, padelFile),
+                                                         self.padelTimeout)
+        if not success:
+            return (False, result)
 
         try:
-            fpr = open ('padel.txt','r')
+            fpr = open (padelFile,'r')
         except:
             return (False, 'PaDEL results not found')
 
@@ -740,52 +1110,126 @@ class model:
 
         if clean:
             try:
-                shutil.rmtree('padel')
-                removefile ('padel.txt')
+                shutil.rmtree(padelDir)
+                removefile (padelFile)
             except:
                 pass
 
         return (True,md)
 
-    def computeMDPadelcl (self, mol, clean=False):
-        """ Computes PaDEL Molecular Descriptors for compound "mol"
-
-            In this implementation we use PaDEL calling the Java VM. This is
-            less efficient than computeMDPadelws for large collections of compounds
+    def computeMDPadelwsBatch (self, mols):
+        """ Computes PaDEL Molecular Descriptors for all the compounds in list "mols" using the PaDEL web
+            service. When padelURL defines several servers, the compounds are split among them and
+            processed simultaneously; otherwise they are processed in a single call
 
-            It returms a tuple that contains
-            1) True or False, indicating the success of the computation
-            2) A vector of floats (if True) with the PaDEL descriptors
-               An Error message (if False)
+            Returns a list with a tuple like those returned by computeMDPadelws for every compound
         """
-        try:
-            shutil.rmtree('padel')
-        except:
-            pass
+        client = self.getPadelClient ()
 
-        os.mkdir ('padel')
-        shutil.copy (mol,'padel')
+        nparts = min (len(client.urls), len(mols))
+        size = -(-len(mols)//nparts)
+        parts = [mols[j:j+size] for j in range(0,len(mols),size)]
 
-        call = [self.javaPath+'bin/java','-Djava.awt.headless=true','-jar',
-                self.padelPath+'PaDEL-Descriptor.jar',
-                '-dir','./padel',
-                '-file','padel.txt']
+        padelFiles = []
+        paramsList = []
+        for j, part in enumerate(parts):
+            padelDir = os.path.abspath (self.scratchFile ('padel%d' % j))
+            padelFile = os.path.abspath (self.scratchFile ('padel%d.txt' % j))
 
-        for key in self.padelMD:
-            call.append (key)
+            try:
+                shutil.rmtree(padelDir)
+            except:
+                pass
 
-        stdoutf = open (os.devnull, 'w')
-        stderrf = open (os.devnull, 'w')
-        try:
-            retcode = subprocess.call(call,stdout=stdoutf,stderr=stderrf)
-        except:
-            return (True, 'PaDEL execution error' )
-        finally:
-            stdoutf.close()
+            os.mkdir (padelDir)
+            self.writeBatch (os.path.join (padelDir, 'batch.sdf'), part)
+
+            padelFiles.append ((padelDir, padelFile))
+            paramsList.append (self.getPadelParams (padelDir, padelFile))
+
+        answers = client.computeMany (paramsList, self.padelTimeout and self.padelTimeout*size)
+
+        results = []
+        for j, part in enumerate(parts):
+            padelDir, padelFile = padelFiles[j]
+            success, error = answers[j]
+
+            lines = {}
+            if success:
+                lines = self.readBatchCSV (padelFile, len(part), True)
+
+            try:
+                shutil.rmtree(padelDir)
+                removefile (padelFile)
+            except:
+                pass
+
+            for k in range(len(part)):
+                if not success:
+                    results.append ((False, error))
+                    continue
+
+                if k not in lines:
+                    results.append ((False, 'PaDEL results not found'))
+                    continue
+
+                md = np.genfromtxt(StringIO(lines[k]),delimiter=',')
+                md = np.nan_to_num(md)
+
+                # detected a rare bug producing extremely large PaDel descriptors (>1.0e300), leading to overflows
+                # apply a conservative top cutoff of 1.0e10
+                md [ md > 1.0e10 ] = 1.0e10
+
+                results.append ((True, md))
+
+        return results
+
+    def computeMDPadelcl (self, mol, clean=False):
+        """ Computes PaDEL Molecular Descriptors for compound "mol"
+
+            In this implementation we use PaDEL calling the Java VM. This is
+            less efficient than computeMDPadelws for large collections of compounds
+
+            It returms a tuple that contains
+            1) True or False, indicating the success of the computation
+            2) A vector of floats (if True) with the PaDEL descriptors
+               An Error message (if False)
+        """
+        padelDir = os.path.abspath (self.scratchFile ('padel'))
+        padelFile = os.path.abspath (self.scratchFile ('padel.txt'))
+
+        try:
+            shutil.rmtree(padelDir)
+        except:
+            pass
+
+        os.mkdir (padelDir)
+        mol = asMolecule (mol)
+        mol.saveAs (os.path.join (padelDir, os.path.basename(mol.name)))
+
+        call = [self.javaPath+'bin/java','-Djava.awt.headless=true','-jar',
+                self.padelPath+'PaDEL-Descriptor.jar',
+                '-dir',padelDir,
+                '-file',padelFile]
+
+        for key in self.padelMD:
+            call.append (key)
+
+        stdoutf = open (os.devnull, 'w')
+        stderrf = open (os.devnull, 'w')
+        try:
+            retcode = callTimeout (call, self.padelTimeout, stdoutf, stderrf)
+        except:
+            return (True, 'PaDEL execution error' )
+        finally:
+            stdoutf.close()
             stderrf.close()
 
+        if retcode is None:
+            return (False, 'PaDEL execution timeout')
+
         try:
-            fpr = open ('padel.txt','r')
+            fpr = open (padelFile,'r')
         except:
             return (False, 'PaDEL results not found')
 
@@ -802,8 +1246,8 @@ class model:
 
         if clean:
             try:
-                shutil.rmtree('padel')
-                removefile ('padel.txt')
+                shutil.rmtree(padelDir)
+                removefile (padelFile)
             except:
                 pass
 
@@ -814,12 +1258,10 @@ class model:
         md = np.zeros (2, dtype='float64')
 
         try:
-            suppl = Chem.SDMolSupplier(mol)
+            mi = asMolecule(mol).getMol()
         except:
             return (False, 'unable to open molfile')
 
-        mi = suppl.next()
-
         if mi is None:
             return (False, 'wrong input format')
 
@@ -848,13 +1290,12 @@ class model:
                     
     def computeMDExternal (self, mol):
 
+        mol = asMolecule (mol)
         try:
-            suppl = Chem.SDMolSupplier(mol)
+            mi = mol.getMol()
         except:
             return (False, 'unable to open molfile')
 
-        mi = suppl.next()
-
         if mi is None:
             return (False, 'wrong input format')
 
@@ -877,16 +1318,82 @@ class model:
 
                 return (True, md)
 
-        return (False, 'unable to assign MD to molecule'+mol) 
+        return (False, 'unable to assign MD to molecule'+mol.name) 
         
 
+    def getMDCache (self):
+        """ Returns the cache of MD or None if it is not used by this model. The cache is never used for
+            confidential models, for MD obtained from external sources or for MD computed by methods
+            overridden in the imodel, which could differ from those computed by other models
+        """
+
+        if not self.cacheMD or self.confidential:
+            return None
+
+        if not self.MD or 'external' in self.MD:
+            return None
+
+        if self.isOverridden ('computeMD'):
+            return None
+
+        for md, method in [('pentacle', 'computeMDPentacle'),
+                           ('padel', 'computeMDPadelws'),
+                           ('adriana', 'computeMDAdriana')]:
+            if md in self.MD and self.isOverridden (method):
+                return None
+
+        if self.mdCache is None:
+            self.mdCache = cache (self.cachePath+'/md', self.cacheSize)
+
+        return self.mdCache
+
+    def getMDKey (self, mdCache, mol):
+        """ Returns the key of compound "mol" in the cache of MD. This is built from the normalized
+            structure, the normalization settings and the program computing the MD and its settings
+        """
+
+        if 'pentacle' in self.MD:
+            engine = (self.pentaclePath, self.pentacleProbes, self.pentacleOthers)
+        elif 'padel' in self.MD:
+            engine = (self.padelPath, self.padelURL, self.padelMD, self.padelMaxRuntime, self.padelDescriptor)
+        elif 'adriana' in self.MD:
+            engine = (self.adrianaPath,)
+        else:
+            engine = ()
+
+        norm = (self.norm, self.normStand, self.normNeutr, self.normNeutrMethod, self.normNeutr_pH, self.norm3D)
+
+        return mdCache.key ('MD', self.MD, engine, norm, mol.getStructure())
+
     def computeMD (self, mol, clean=True):
         """ Computes Molecular Descriptors for compound "mol"
 
             This is just a wrapper method that calls the appropriate
             computeMDxxxxx metho, depending on the MD used by this model
+
+            The MD are obtained from the cache of MD when the same structure was
+            already processed with the same settings by any model
         """
 
+        mol = asMolecule (mol)
+
+        # MD computed before, together with other compounds (see computeMDBatch)
+        if mol.name in self.mdBatch:
+            return self.mdBatch[mol.name]
+
+        mdKey = None
+        mdCache = self.getMDCache ()
+        if mdCache:
+            try:
+                mdKey = self.getMDKey (mdCache, mol)
+            except:
+                mdKey = None
+
+            if mdKey:
+                md = mdCache.get (mdKey)
+                if md is not None:
+                    return (True, md)
+
         if 'pentacle' in self.MD:
             success, md = self.computeMDPentacle (mol, clean)
         elif 'padel' in self.MD:
@@ -898,8 +1405,60 @@ class model:
 
 ##        print md
 
+        if mdKey and success and isinstance (md, np.ndarray):
+            mdCache.put (mdKey, md)
+
         return (success, md)
 
+    def computeMDBatch (self, mols):
+        """ Computes Molecular Descriptors for all the compounds in list "mols", running the external
+            program only once for all the compounds not found in the cache of MD
+
+            The results are kept in self.mdBatch, where computeMD will find them, and also returned as
+            a list with a tuple like those returned by computeMD for every compound
+        """
+
+        results = [None]*len(mols)
+        keys = [None]*len(mols)
+
+        mdCache = self.getMDCache ()
+        if mdCache:
+            for k, mol in enumerate(mols):
+                try:
+                    keys[k] = self.getMDKey (mdCache, mol)
+                except:
+                    continue
+
+                md = mdCache.get (keys[k])
+                if md is not None:
+                    results[k] = (True, md)
+
+        pending = [k for k in range(len(mols)) if results[k] is None]
+        pmols = [mols[k] for k in pending]
+
+        if not pmols:
+            presults = []
+        elif 'pentacle' in self.MD and not self.isOverridden ('computeMDPentacle'):
+            presults = self.computeMDPentacleBatch (pmols)
+        elif 'padel' in self.MD and not self.isOverridden ('computeMDPadelws'):
+            presults = self.computeMDPadelwsBatch (pmols)
+        elif 'adriana' in self.MD and not self.isOverridden ('computeMDAdriana'):
+            presults = self.computeMDAdrianaBatch (pmols)
+        else:
+            presults = [self.computeMD (mol) for mol in pmols]
+
+        for k, result in zip(pending, presults):
+            results[k] = result
+
+            success, md = result
+            if keys[k] and success and isinstance (md, np.ndarray):
+                mdCache.put (keys[k], md)
+
+        for mol, result in zip(mols, results):
+            self.mdBatch[mol.name] = result
+
+        return results
+
 ##################################################################
 ##    NORMALIZE METHODS
 ##################################################################
@@ -910,13 +1469,12 @@ class model:
             We first used the field defined by SDFileName parameter, then the firt line and last a seq number
         """
 
+        molFile = asMolecule (molFile)
         try:
-            suppl=Chem.SDMolSupplier(molFile)
+            mi = molFile.getMol()
         except:
             return (False, 'unable to open molfile')
 
-        mi = suppl.next()
-
         if mi is None:
             return (False, 'wrong input format')
 
@@ -932,7 +1490,7 @@ class model:
         name = name.encode('ascii','ignore')  # use 'replace' to insert '?'
 
         if not name:
-            name = molFile[:-4]
+            name = os.path.basename(molFile.name)[:-4]
 
         if ' ' in name:
             name = name.replace(' ','_')
@@ -949,15 +1507,13 @@ class model:
            2) (if True ) The name of the output molecule
               (if False) The error message
         """
-        molo = 'a'+moli
+        moli = asMolecule (moli)
 
         try:
-            suppl=Chem.SDMolSupplier(moli)
+            m = moli.getMol()
         except:
             return (False, 'unable to open molfile')
 
-        m = suppl.next()
-
         if m is None:
             return (False, "wrong input format")
 
@@ -969,31 +1525,39 @@ class model:
             else:
                 return (False, e.name)
 
-        fo = open (molo,'w')
-        fo.write(parent)
+        # the standardized molecule is kept in memory
+        molo = molecule (moli.derivedName('a'), parent+self.getStandardizedFields(m))
+
+        if clean:
+            moli.clean()
+
+        return (True,molo)
+
+    def getStandardizedFields (self, m):
+        """Returns the text of the SDFile fields of molecule m (a RDKit molecule) which are kept in the
+           standardized molecule
+        """
+
+        fo = []
 
         if self.SDFileActivity:
             if m.HasProp(self.SDFileActivity):
                 activity = m.GetProp(self.SDFileActivity)
-                fo.write('>  <'+self.SDFileActivity+'>\n'+activity+'\n')
+                fo.append('>  <'+self.SDFileActivity+'>\n'+activity+'\n')
 
         if self.SDFileExperimental:
             if m.HasProp(self.SDFileExperimental):
                 exp = m.GetProp(self.SDFileExperimental)
-                fo.write('>  <'+self.SDFileExperimental+'>\n'+exp+'\n')
+                fo.append('>  <'+self.SDFileExperimental+'>\n'+exp+'\n')
 
         for prop in self.SDFileMetadata:
             if m.HasProp(prop):
                 exp = m.GetProp(prop)
-                fo.write('>  <'+prop+'>\n'+exp+'\n')
+                fo.append('>  <'+prop+'>\n'+exp+'\n')
 
-        fo.write('\n$$$$')
-        fo.close()
+        fo.append('\n$$$$')
 
-        if clean:
-            removefile (moli)
-
-        return (True,molo)
+        return ''.join(fo)
 
     def protonate (self, moli, pH, clean=True):
         """Adjusts the ionization state of the molecule "moli"
@@ -1005,23 +1569,28 @@ class model:
               (if False) The error message
         """
 
-        molo = 'b'+moli
+        moli = asMolecule (moli)
+        molo = molecule (moli.derivedName('b'))
 
         stderrf = open (os.devnull, 'w')
         stdoutf = open (os.devnull, 'w')
 
-        call = [self.mokaPath+'blabber_sd', moli,
+        call = [self.mokaPath+'blabber_sd', moli.getFile(),
                 '-p',  str(pH),
-                '-o',  molo]
+                '-o',  molo.name]
 
         try:
-            retcode = subprocess.call(call,stdout=stdoutf, stderr=stderrf)
+            retcode = callTimeout (call, self.mokaTimeout, stdoutf, stderrf)
         except:
             return (False, 'Blabber execution error', 0.0)
 
         stdoutf.close()
         stderrf.close()
 
+        if retcode is None:
+            removefile (molo.name)
+            return (False, 'Blabber execution timeout', 0.0)
+
         if 'blabber110' in self.mokaPath: # in old blabber versions, error is reported as '0'
             if retcode == 0:
                 return (False, 'Blabber 1.0 execution error', 0.0)
@@ -1030,26 +1599,94 @@ class model:
                 return (False, 'Blabber execution error', 0.0)
 
         try:
-            if os.stat(molo).st_size==0:
+            if os.stat(molo.name).st_size==0:
                 return (False, 'Blabber output is empty', 0.0)
 
-            finp = open (molo)
+            block = molo.getBlock()
         except:
             return (False, 'Blabber output not found', 0.0)
 
+        charge = self.getCharge (block)
+
+        if clean:
+            moli.clean()
+
+        return (True, molo, charge)
+
+    def getCharge (self, block):
+        """Returns the formal charge of the molecule in block (SDFile format), as the sum of the charges
+           in the first 'M  CHG' line
+        """
+
         charge = 0
-        for line in finp:
+        for line in block.splitlines():
             if line.startswith ('M  CHG'):
                 items = line.split()
                 if int(items[2]):
                     for c in range (4,len(items),2): charge+=int(items[c])
                 break
-        finp.close()
 
-        if clean:
-            removefile (moli)
+        return charge
 
-        return (True, molo, charge)
+    def protonateBatch (self, mols, pH):
+        """Adjusts the ionization state of all the molecules in list "mols" in a single call to blabber_sd
+
+           Returns a list with a tuple like those returned by protonate for every molecule
+        """
+
+        fin, fout = self.batchFiles ()
+        self.writeBatch (fin, mols)
+
+        stderrf = open (os.devnull, 'w')
+        stdoutf = open (os.devnull, 'w')
+
+        call = [self.mokaPath+'blabber_sd', fin,
+                '-p',  str(pH),
+                '-o',  fout]
+
+        timeout = False
+        try:
+            retcode = callTimeout (call, self.mokaTimeout and self.mokaTimeout*len(mols), stdoutf, stderrf)
+            timeout = retcode is None
+        except:
+            retcode = None
+
+        stdoutf.close()
+        stderrf.close()
+
+        # the compound hanging the program is found processing the compounds one by one
+        if timeout:
+            removefile (fin)
+            removefile (fout)
+            return [self.protonate (moli, pH, False) for moli in mols]
+
+        error = None
+        if retcode is None:
+            error = 'Blabber execution error'
+        elif 'blabber110' in self.mokaPath: # in old blabber versions, error is reported as '0'
+            if retcode == 0:
+                error = 'Blabber 1.0 execution error'
+        else:
+            if retcode != 0:
+                error = 'Blabber execution error'
+
+        blocks = {}
+        if error is None:
+            blocks = self.readBatch (fout, mols)
+
+        removefile (fin)
+        removefile (fout)
+
+        results = []
+        for k, moli in enumerate(mols):
+            if error:
+                results.append ((False, error, 0.0))
+            elif k in blocks:
+                results.append ((True, molecule (moli.derivedName('b'), blocks[k]), self.getCharge (blocks[k])))
+            else:
+                results.append ((False, 'Blabber output not found', 0.0))
+
+        return results
 
 
     def convert3D (self, moli, clean=True):
@@ -1062,48 +1699,227 @@ class model:
               (if False) The error mesage
         """
 
-        molo = 'c'+moli
+        moli = asMolecule (moli)
+        molo = molecule (moli.derivedName('c'))
 
         stderrf = open (os.devnull, 'w')
         stdoutf = open (os.devnull, 'w')
 
         call = [self.corinaPath+'corina',
                 '-dwh','-dori',
-                '-ttracefile=corina.trc',
-                '-it=sdf', moli,
-                '-ot=sdf', molo]
+                '-ttracefile='+self.scratchFile ('corina.trc'),
+                '-it=sdf', moli.getFile(),
+                '-ot=sdf', molo.name]
 
         try:
-            retcode = subprocess.call(call, stdout=stdoutf, stderr=stderrf)
+            retcode = callTimeout (call, self.corinaTimeout, stdoutf, stderrf)
         except:
             return (False, 'Corina execution error')
 
         stdoutf.close()
         stderrf.close()
 
+        if retcode is None:
+            removefile (molo.name)
+            return (False, 'Corina execution timeout')
+
         if retcode != 0:
             return (False, 'Corina execution error')
 
-        if not os.path.exists(molo):
+        if not os.path.exists(molo.name):
             return (False, 'Corina output not found')
 
         if clean:
-            removefile(moli)
-            removefile('corina.trc')
+            moli.clean()
+            removefile(self.scratchFile ('corina.trc'))
 
         return (True,molo)
 
 
+    def convert3DBatch (self, mols):
+        """Converts the 2D structure of all the molecules in list "mols" to 3D in a single call to CORINA
+
+           Returns a list with a tuple like those returned by convert3D for every molecule
+        """
+
+        fin, fout = self.batchFiles ()
+        self.writeBatch (fin, mols)
+
+        stderrf = open (os.devnull, 'w')
+        stdoutf = open (os.devnull, 'w')
+
+        call = [self.corinaPath+'corina',
+                '-dwh','-dori',
+                '-ttracefile='+self.scratchFile ('corina.trc'),
+                '-it=sdf', fin,
+                '-ot=sdf', fout]
+
+        timeout = False
+        try:
+            retcode = callTimeout (call, self.corinaTimeout and self.corinaTimeout*len(mols), stdoutf, stderrf)
+            timeout = retcode is None
+        except:
+            retcode = None
+
+        stdoutf.close()
+        stderrf.close()
+
+        # the compound hanging the program is found processing the compounds one by one
+        if timeout:
+            removefile (fin)
+            removefile (fout)
+            removefile (self.scratchFile ('corina.trc'))
+            return [self.convert3D (moli, False) for moli in mols]
+
+        blocks = {}
+        if retcode == 0:
+            blocks = self.readBatch (fout, mols)
+
+        removefile (fin)
+        removefile (fout)
+        removefile (self.scratchFile ('corina.trc'))
+
+        results = []
+        for k, moli in enumerate(mols):
+            if retcode != 0:
+                results.append ((False, 'Corina execution error'))
+            elif k in blocks:
+                results.append ((True, molecule (moli.derivedName('c'), blocks[k])))
+            else:
+                results.append ((False, 'Corina output not found'))
+
+        return results
+
+    def scratchFile (self, name):
+        """Returns the path of a temporary file (or directory) "name", located in the scratch directory
+           of the workflow run or worker process, so concurrent runs never share it. Outside the
+           workflows, the file is located in the working directory
+        """
+
+        base = self.scratch if self.scratch else '.'
+
+        return os.path.join (base, name)
+
+    def keepScratchFile (self, name):
+        """Copies the file "name" from the scratch directory to the working directory, so it is kept after
+           the scratch directory is removed
+        """
+
+        try:
+            shutil.copy (self.scratchFile (name), name)
+        except:
+            pass
+
+    def batchFiles (self):
+        """Returns the names of an input and an output file for processing molecules in batch, located
+           in the scratch directory of the workflow
+        """
+
+        name = self.scratchFile (randomName(20))
+
+        return (name+'-in.sdf', name+'-out.sdf')
+
+    def writeBatch (self, fileName, mols):
+        """Writes all the molecules in list "mols" to a single SDFile. The title of every molecule is
+           replaced by a tag containing its position in the list, so the molecules can be identified in
+           the output of the external programs (see readBatch and readBatchCSV)
+        """
+
+        f = open (fileName,'w')
+        for k, mol in enumerate(mols):
+            rest = mol.getBlock().partition('\n')[2].rstrip()
+            if not rest.endswith('$$$$'):
+                rest += '\n$$$$'
+            f.write ('etoxlab%0.6d\n' % k + rest + '\n')
+        f.close()
+
+    def getBatchTag (self, title, nmol):
+        """Returns the position of the molecule tagged with "title" by writeBatch or None if it is not a
+           valid tag for a batch of nmol molecules
+        """
+
+        title = title.strip().strip('"')
+        if not title.startswith('etoxlab'):
+            return None
+
+        try:
+            k = int(title[7:])
+        except:
+            return None
+
+        if k<0 or k>=nmol:
+            return None
+
+        return k
+
+    def readBatch (self, fileName, mols):
+        """Reads a SDFile generated by an external program from the SDFile written by writeBatch for the
+           molecules in list "mols". The original title of every molecule is restored
+
+           Returns a dictionary with the position of the molecules as key and the molecule (in SDFile
+           format) as value. Only the first record of every molecule is considered
+        """
+
+        blocks = {}
+
+        try:
+            f = open (fileName,'r')
+        except:
+            return blocks
+
+        for block in readSDF (f):
+            title, sep, rest = block.partition('\n')
+
+            k = self.getBatchTag (title, len(mols))
+            if k is None or k in blocks:
+                continue
+
+            blocks[k] = mols[k].getBlock().partition('\n')[0]+'\n'+rest
+
+        f.close()
+
+        return blocks
+
+    def readBatchCSV (self, fileName, nmol, header):
+        """Reads a CSV file generated by an external program from the SDFile written by writeBatch for
+           nmol molecules, with the molecule title as first column. When header is True the first line
+           contains the column labels and is skipped
+
+           Returns a dictionary with the position of the molecules as key and the rest of the line as value
+        """
+
+        lines = {}
+
+        try:
+            f = open (fileName,'r')
+        except:
+            return lines
+
+        if header:
+            f.readline()
+
+        for line in f:
+            title, sep, rest = line.partition(',')
+
+            k = self.getBatchTag (title, nmol)
+            if k is None or k in lines:
+                continue
+
+            lines[k] = rest
+
+        f.close()
+
+        return lines
+
     def checkExperimental (self, mol):
         """ Checks if the compound "mol" already contains the value we aim to predict
 
         """
         try:
-            suppl = Chem.SDMolSupplier(mol)
+            mi = asMolecule(mol).getMol()
         except:
             return (False, 'unable to open molfile')
 
-        mi = suppl.next()
         if mi is None:
             return (False, 'wrong input format')
 
@@ -1136,11 +1952,10 @@ class model:
         lg.setLevel(RDLogger.ERROR)
 
         try:
-            suppl = Chem.SDMolSupplier(mol)
+            mi = asMolecule(mol).getMol()
         except:
             return (False, 'unable to open molfile')
 
-        mi = suppl.next()
         if mi is None:
             return (False, 'wrong input format')
 
@@ -1154,18 +1969,21 @@ class model:
 
         ik = ik[:-3] # remove the right-most part expressing ionization
 
-        for l in self.tdata:   # the InChi is the element 1 of the tuple and the Activity is the element 4
+        # use the index loaded by loadIdentityIndex or, if not available, build it from the tdata
+        tindex = self.tindex
+        if tindex is None:
+            tindex = self.getIdentityIndex (self.tdata)
 
-            if ik in l[1]:
+        if ik in tindex:
 
-                yp = float (l[4])
+            yp = float (tindex[ik])
 
-                if self.quantitative:
-                    return (True, yp)
-                if (yp < ypcutoff):
-                    return (True, 'negative')
-                else:
-                    return (True, 'positive')
+            if self.quantitative:
+                return (True, yp)
+            if (yp < ypcutoff):
+                return (True, 'negative')
+            else:
+                return (True, 'positive')
 
         return (False, mol)
 
@@ -1180,12 +1998,11 @@ class model:
             return False
         
         try:
-            supplOri=Chem.SDMolSupplier(molOriginal)
+            mori = asMolecule(molOriginal).getMol()
+            block = asMolecule(molProcessed).getBlock()
         except:
             return False
 
-        mori = supplOri.next()
-
         if mori is None:
             return False
         
@@ -1193,11 +2010,9 @@ class model:
 
         # dump the contents of the original SDFile into the output file
         # until the 'M  END' tag definining the end of the structure
-        fi = open (molProcessed)
-        for line in fi:
+        for line in block.splitlines(True):
             fo.write(line)
             if 'M  END' in line:
-                fi.close()
                 break
 
         # add all fields
@@ -1216,6 +2031,34 @@ class model:
         return True
 
 
+    def getNormCache (self):
+        """ Returns the cache of normalized structures or None if it is not used by this model. The cache
+            is never used for confidential models or when the imodel overrides the normalization methods,
+            since their results could differ from those of other models
+        """
+
+        if not self.cacheNorm or self.confidential:
+            return None
+
+        for method in ['normalize', 'standardize', 'protonate', 'convert3D']:
+            if self.isOverridden (method):
+                return None
+
+        if self.normCache is None:
+            self.normCache = cache (self.cachePath+'/norm', self.cacheSize)
+
+        return self.normCache
+
+    def getNormKey (self, normCache, mol):
+        """ Returns the key of compound "mol" in the cache of normalized structures. This is built from the
+            input structure, the normalization settings and the programs used
+        """
+
+        norm = (self.normStand, self.normNeutr, self.normNeutrMethod, self.normNeutr_pH, self.norm3D)
+        tools = (self.standardiserPath, self.mokaPath, self.corinaPath)
+
+        return normCache.key ('norm', norm, tools, mol.getStructure())
+
     def normalize (self, mol):
         """Preprocesses the molecule "mol" by running a workflow that:
 
@@ -1225,12 +2068,14 @@ class model:
 
         The result is a tuple containing:
         1) True/False: describes the success of the normalization
-        2) (if True ) The name of the normalized molecule and its formal charge
+        2) (if True ) The normalized molecule, its name and its formal charge
            (if False) The error mesage
         """
 
         charge = 0.0 #fallback
 
+        mol = asMolecule (mol)
+
         success, result = self.getMolName (mol)
         if not success: return (False, result)
 
@@ -1239,6 +2084,11 @@ class model:
         if not self.norm:
             return (True, (mol, molName, charge))
 
+        # the same structure could have been normalized before, with the same settings, by any model
+        normKey, result = self.loadNormalized (mol)
+        if result is not None:
+            return (True, (result[0], molName, result[1]))
+
         if self.normStand:
             success, resulta = self.standardize (mol)
             if not success:
@@ -1258,13 +2108,229 @@ class model:
         else:
             resultc = resultb
 
+        self.saveNormalized (normKey, resultc, charge)
+
         return (True,(resultc, molName, charge))
 
+    def loadNormalized (self, mol):
+        """Looks for the molecule "mol" in the cache of normalized structures
+
+           Returns a tuple with the key of the molecule in the cache (None if the cache is not used) and
+           a tuple with the normalized molecule and its formal charge (None if not found)
+        """
+
+        normCache = self.getNormCache ()
+        if not normCache:
+            return (None, None)
+
+        try:
+            normKey = self.getNormKey (normCache, mol)
+        except:
+            return (None, None)
+
+        result = normCache.get (normKey)
+        if result is None:
+            return (normKey, None)
+
+        molBlock, charge = result
+
+        # the entry could have been stored for another compound with the same structure, so the title line
+        # is that of the input molecule
+        title = mol.getMolBlock().splitlines(True)[:1]
+        molBlock = ''.join(title + molBlock.splitlines(True)[1:])
+
+        # the SDFile fields are those of the input molecule
+        if self.normStand:
+            fields = self.getStandardizedFields (mol.getMol())
+        else:
+            fields = mol.getFields()
+
+        return (normKey, (molecule (mol.derivedName('n'), molBlock+fields), charge))
+
+    def saveNormalized (self, normKey, mol, charge):
+        """Stores the normalized molecule "mol" and its formal charge in the cache of normalized structures
+        """
+
+        if not normKey:
+            return
+
+        try:
+            self.getNormCache().put (normKey, (mol.getMolBlock(), charge))
+        except:
+            pass
+
+    def normalizeBatch (self, mols):
+        """Preprocesses all the molecules in list "mols" like normalize, but running every external program
+           only once for all the molecules
+
+           Returns a list with a tuple like those returned by normalize for every molecule
+        """
+
+        if self.isOverridden ('normalize'):
+            return [self.normalize (mol) for mol in mols]
+
+        results = [None]*len(mols)
+
+        # every element is a list with the position of the molecule, the molecule (updated in every step),
+        # its name, its key in the cache of normalized structures and its formal charge
+        pending = []
+
+        for k, mol in enumerate(mols):
+            success, result = self.getMolName (mol)
+            if not success:
+                results[k] = (False, result)
+                continue
+
+            if not self.norm:
+                results[k] = (True, (mol, result, 0.0))
+                continue
+
+            normKey, normalized = self.loadNormalized (mol)
+            if normalized is not None:
+                results[k] = (True, (normalized[0], result, normalized[1]))
+                continue
+
+            pending.append ([k, mol, result, normKey, 0.0])
+
+        if self.normStand:
+            for p in pending:
+                success, result = self.standardize (p[1])
+                if not success:
+                    results[p[0]] = (False, result)
+                    continue
+                p[1] = result
+            pending = [p for p in pending if results[p[0]] is None]
+
+        if self.normNeutr and pending:
+            if self.isOverridden ('protonate'):
+                protonated = [self.protonate (p[1], self.normNeutr_pH) for p in pending]
+            else:
+                protonated = self.protonateBatch ([p[1] for p in pending], self.normNeutr_pH)
+
+            for p, (success, result, charge) in zip(pending, protonated):
+                if not success:
+                    results[p[0]] = (False, result)
+                    continue
+                p[1] = result
+                p[4] = charge
+            pending = [p for p in pending if results[p[0]] is None]
+
+        if self.norm3D and pending:
+            if self.isOverridden ('convert3D'):
+                converted = [self.convert3D (p[1]) for p in pending]
+            else:
+                converted = self.convert3DBatch ([p[1] for p in pending])
+
+            for p, (success, result) in zip(pending, converted):
+                if not success:
+                    results[p[0]] = (False, result)
+                    continue
+                p[1] = result
+            pending = [p for p in pending if results[p[0]] is None]
+
+        for k, mol, molName, normKey, charge in pending:
+            self.saveNormalized (normKey, mol, charge)
+            results[k] = (True, (mol, molName, charge))
+
+        return results
+
 
 ##################################################################
 ##    PREDICT METHODS
 ##################################################################
 
+    def loadPredictionContext (self):
+        """Loads the model artifacts used for prediction (PLS or RF model, ADAN model and tscores), so
+           they are read from disk only once and reused for every compound of the series
+
+           Any artifact loaded previously is discarded, since the model could have been rebuilt
+        """
+
+        self.predPLS = None
+        self.predRF = None
+        self.predADAN = None
+        self.predTScores = None
+
+        # models not built yet are reported later, when the artifact is actually needed
+        try:
+            if self.model == 'pls':
+                self.getModelPLS ()
+                if not self.confidential:
+                    self.getModelADAN ()
+            elif self.model == 'RF':
+                self.getModelRF ()
+        except:
+            pass
+
+    def getModelPLS (self):
+        """Returns the PLS model of this version, loading it from disk only the first time
+        """
+
+        if self.predPLS is None:
+            model = pls()
+
+            # models built by older versions do not contain the compiled model, which is obtained here
+            if os.path.isfile (self.vpath+'/compiledPLS.npy'):
+                model.loadCompiled(self.vpath+'/compiledPLS.npy')
+            else:
+                if not self.confidential:
+                    model.loadModel(self.vpath+'/modelPLS.npy', full=False)
+                else:
+                    model.loadDistiled(self.vpath+'/distiledPLS.txt')
+                model.compile()
+
+            self.predPLS = model
+
+        return self.predPLS
+
+    def getModelRF (self):
+        """Returns the RF model of this version, loading it from disk only the first time
+        """
+
+        if self.predRF is None:
+            rfmodel = RF()
+            rfmodel.loadModel(self.vpath+'/RFModel.npy')
+            self.predRF = rfmodel
+
+        return self.predRF
+
+    def getModelADAN (self):
+        """Returns a tuple with the ADAN PLS model (adan.npy) and a dictionary with the information
+           extracted from the training series (tscores.npy), loading them from disk only the first time
+        """
+
+        if self.predADAN is None:
+
+            keys = ['nlv', 'p95dcentx', 'p95dclosx', 'p95dmodx', 'p95dcenty', 'p95dclosy', 'p95dpredy',
+                    'centx', 'centy', 'T', 'Y', 'squareErr']
+
+            # models built by older versions contain a sequence of numpy .npy records
+            if isModelFile (self.vpath+'/tscores.npy'):
+                tscores = loadModelFile (self.vpath+'/tscores.npy', 'tscores', keys)
+            else:
+                f = file (self.vpath+'/tscores.npy','rb')
+                tscores = dict()
+                for key in keys:
+                    tscores[key] = np.load(f)
+                f.close()
+
+            # KD-tree index of the training series scores. Models built by older versions
+            # do not contain this file, and the tree is built here
+            try:
+                ft = open (self.vpath+'/tscores-tree.pkl','rb')
+                tscores['tree'] = pickle.load(ft)
+                ft.close()
+            except:
+                tscores['tree'] = KDTree(tscores['T'])
+
+            model = pls ()
+            model.loadModel(self.vpath+'/adan.npy', full=False)
+
+            self.predTScores = tscores
+            self.predADAN = model
+
+        return (self.predADAN, self.predTScores)
+
     def computePredictionOther (self, md, charge):
         # empty method to be overriden
         return (False, 'not implemented')
@@ -1277,11 +2343,7 @@ class model:
             The model has been loaded previously as an R object
         """
 
-        model = pls()
-        if not self.confidential:
-            model.loadModel(self.vpath+'/modelPLS.npy')
-        else:
-            model.loadDistiled(self.vpath+'/distiledPLS.txt')
+        model = self.getModelPLS ()
 
         if 'pentacle' in self.MD:
             md = self.adjustPentacle(md,len(self.pentacleProbes),model.nvarx)
@@ -1307,8 +2369,7 @@ class model:
 
     def computePredictionRF  (self, md, charge):
 
-        rfmodel = RF()
-        rfmodel.loadModel(self.vpath+'/RFModel.npy')
+        rfmodel = self.getModelRF ()
 
         if 'pentacle' in self.MD:
             md = self.adjustPentacle(md,len(self.pentacleProbes),rfmodel.nvarx)
@@ -1378,6 +2439,88 @@ class model:
 
         return (success, result)
 
+    def getMatrixMD (self, MD, nvarx):
+        """ Returns a NumPy matrix with the MD vectors in list MD, adjusted to nvarx columns in case of Pentacle MD,
+            and a boolean array flagging the rows with the right number of MD
+        """
+
+        nobj = len(MD)
+
+        X = np.zeros ((nobj,nvarx),dtype=np.float64)
+        valid = np.zeros (nobj,dtype=bool)
+
+        for i in range (nobj):
+            md = MD[i]
+            if 'pentacle' in self.MD:
+                md = self.adjustPentacle(md,len(self.pentacleProbes),nvarx)
+            if len(md) != nvarx:
+                continue
+            X[i,:] = md
+            valid[i] = True
+
+        return X, valid
+
+    def computePredictionBatch (self, MD, charges):
+        """ Batch version of computePrediction, projecting all the MD vectors in list MD in a single call
+            to the PLS or RF model
+
+            Returns a list of tuples, with the same content returned by computePrediction, for every compound
+        """
+
+        results = [(False, 'wrong number of MD')]*len(MD)
+
+        if self.model == 'pls':
+
+            model = self.getModelPLS ()
+
+            X, valid = self.getMatrixMD (MD, model.nvarx)
+            if not np.any(valid):
+                return results
+
+            success, result = model.projectBatch(X[valid],self.modelLV)
+            if not success:
+                return [(success, result)]*len(MD)
+
+            yp = result[0][:,-1]
+
+            if not self.quantitative and len (model.cutoff) == 0:
+                return [(False, 'cutoff not defined')]*len(MD)
+
+            j = 0
+            for i in np.flatnonzero(valid):
+                if self.quantitative:
+                    results[i] = (True, yp[j])
+                elif yp[j] < model.cutoff[-1]: # use last cutoff
+                    results[i] = (True, 'negative')
+                else:
+                    results[i] = (True, 'positive')
+                j += 1
+
+        elif self.model == 'RF':
+
+            rfmodel = self.getModelRF ()
+
+            X, valid = self.getMatrixMD (MD, rfmodel.nvarx)
+            if not np.any(valid):
+                return results
+
+            Yp = rfmodel.projectBatch(X[valid])
+
+            j = 0
+            for i in np.flatnonzero(valid):
+                if self.quantitative:
+                    results[i] = (True, Yp[j:j+1])  # same array returned by computePredictionRF
+                elif Yp[j]:
+                    results[i] = (True, 'positive')
+                else:
+                    results[i] = (True, 'negative')
+                j += 1
+
+        else:
+            return [(False, 'not implemented')]*len(MD)
+
+        return results
+
 
 
     def computeAD (self, md, pr, detail):
@@ -1397,114 +2540,113 @@ class model:
         if self.model == 'RF':
             return (False,'not implemented for RF')
 
-        f = file (self.vpath+'/tscores.npy','rb')
-        nlv = np.load(f)
-        p95dcentx = np.load(f)
-        p95dclosx = np.load(f)
-        p95dmodx = np.load(f)
-        p95dcenty = np.load(f)
-        p95dclosy = np.load(f)
-        p95dpredy = np.load(f)
-        centx = np.load(f)
-        centy = np.load(f)
-        T = np.load(f)
-        Y = np.load(f)
-        squareErr = np.load(f)
-        f.close()
-
-        model = pls ()
-        model.loadModel(self.vpath+'/adan.npy')
+        model, tscores = self.getModelADAN ()
 
         if 'pentacle' in self.MD:
             md = self.adjustPentacle(md,len(self.pentacleProbes),model.nvarx)
 
         success, result = model.project(md,model.Am)
 
-        y = pr
-        t = result[1]
-        d = result[2]
+        return (self.evaluateADBatch (np.atleast_2d(result[1]), np.atleast_2d(result[2]), [pr])[0])
+
+    def computeADBatch (self, MD, PR, detail):
+        """Batch version of computeAD, projecting all the query compounds in a single call to the ADAN model
+
+           MD is a list of MD vectors and PR the list of the corresponding predictions
+
+           Returns a list of tuples, with the same content returned by computeAD, for every compound
+        """
+
+        if self.model == 'RF':
+            return [(False,'not implemented for RF')]*len(MD)
+
+        model, tscores = self.getModelADAN ()
+
+        X, valid = self.getMatrixMD (MD, model.nvarx)
+
+        results = [(False, 'wrong number of MD')]*len(MD)
+
+        if not np.any(valid):
+            return results
+
+        success, result = model.projectBatch(X[valid],model.Am)
+        if not success:
+            return [(False, result)]*len(MD)
+
+        ivalid = np.flatnonzero(valid)
+
+        ADvalid = self.evaluateADBatch (result[1], result[2], [PR[i] for i in ivalid])
+
+        for i, ad in zip(ivalid, ADvalid):
+            results[i] = ad
+
+        return results
+
+    def evaluateADBatch (self, T, D, Y):
+        """Applies the ADAN criteria to a set of compounds with scores T (nobj x A), DModX D (nobj x A)
+           and predicted values Y in the ADAN model
+
+           The closest compounds of the training series are obtained with batch queries to a KD-tree
+           built on the training series scores
+
+           Returns a list of tuples, as described in computeAD
+        """
+
+        model, tscores = self.getModelADAN ()
+
+        p95dcentx = tscores['p95dcentx']
+        p95dclosx = tscores['p95dclosx']
+        p95dmodx = tscores['p95dmodx']
+        p95dcenty = tscores['p95dcenty']
+        p95dclosy = tscores['p95dclosy']
+        p95dpredy = tscores['p95dpredy']
+        centx = tscores['centx']
+        centy = tscores['centy']
+        Yt = tscores['Y']
+        squareErr = tscores['squareErr']
+        tree = tscores['tree']
+
+        nobj = np.shape(T)[0]
+        ntrain = np.shape(tscores['T'])[0]
+
+        # number of criteria broken by every compound
+        AD = np.zeros(nobj, dtype=np.int32)
 
-        AD=dict()
         # compute distance t to centroid x (A)
-        dcentx = np.sqrt(np.sum(np.square(centx-t)))
-        AD['dcentx']=dcentx>p95dcentx
+        dcentx = np.sqrt(np.sum(np.square(centx-T),axis=1))
+        AD += dcentx>p95dcentx
 
         # compute min distance to T (B)
-        dclosx = 1e20
-        dclosi = 0
-        for i in range (model.nobj):
-            dtemp = np.sqrt(np.sum(np.square(T[i,:]-t)))
-            if dtemp < dclosx :
-                dclosx = dtemp
-                dclosi = i
+        dclos, iclos = tree.query(T, k=1)
+        dclosx = dclos[:,0]
+        dclosi = iclos[:,0]
 
-        AD['dclosx']=dclosx>p95dclosx
+        AD += dclosx>p95dclosx
 
         # compute distance to modx (C)
-        AD['dmodx']=d[-1]>p95dmodx
+        AD += D[:,-1]>p95dmodx
 
-        # compute distance to centroid y, only for quantitative (D)
         if self.quantitative:
-            dcenty = np.abs(y-centy)
-            AD['dcenty']=dcenty>p95dcenty
-        else:
-            AD['dcenty']=False
-
-        # compute Y of the closer compound (E)
-        if self.quantitative:
-            dclosy = np.abs(y-Y[dclosi])
-            AD['dclosy']=dclosy>p95dclosy
-        else:
-            AD['dclosy']=False
+            Y = np.array(Y, dtype=np.float64)
 
-        # compute SDEP of 5% closer neighbours (F) and percentil 95
-        if self.quantitative:
-            p5 = int(np.rint(0.05*model.nobj))
-            if p5 < 1 : p5 = int(1)
+            # compute distance to centroid y, only for quantitative (D)
+            dcenty = np.abs(Y-centy)
+            AD += dcenty>p95dcenty
 
-            closerDis = np.empty(p5,dtype=np.float64)
-            closerErr = np.empty(p5,dtype=np.float64)
+            # compute Y of the closer compound (E)
+            dclosy = np.abs(Y-Yt[dclosi])
+            AD += dclosy>p95dclosy
 
-            for j in range (p5):
-                closerDis[j]=1e20
+            # compute SDEP of 5% closer neighbours (F) and percentil 95
+            p5 = int(np.rint(0.05*ntrain))
+            if p5 < 1 : p5 = int(1)
 
-            for i in range (model.nobj):
-                dtemp = np.sum(np.square(T[i,:]-t))
-                if dtemp < np.amax(closerDis) :
-                    imindis=np.argmax(closerDis)
-                    closerDis[imindis] = dtemp
-                    closerErr[imindis] = squareErr[i]
+            dp5, ip5 = tree.query(T, k=p5)
 
-            dpredy=np.sqrt(np.sum(closerErr)/p5)
-            AD['dpredy']=dpredy>p95dpredy
-        else:
-            AD['dpredy']=False
-
-##        print '[',
-##        if AD['dcentx'] : print '1 ',
-##        else : print '0 ',
-##        if AD['dclosx'] : print '1 ',
-##        else : print '0 ',
-##        if AD['dmodx' ] : print '1 ',
-##        else : print '0 ',
-##        if AD['dcenty'] : print '1 ',
-##        else : print '0 ',
-##        if AD['dclosy'] : print '1 ',
-##        else : print '0 ',
-##        if AD['dpredy'] : print '1 ',
-##        else : print '0 ',
-##        print '] %d' % sum (AD.values())
-
-##        print "DCENTX %6.3f (%6.3f)\n" % (dcentx,p95dcentx),
-##        print "DCLOSX %6.3f (%6.3f)\n" % (dclosx,p95dclosx),
-##        print "DCMODX %6.3f (%6.3f)\n" % (d[-1],p95dmodx),
-##
-##        if self.quantitative:
-##            print "DCENTY %6.3f (%6.3f)\n" % (dcenty,p95dcenty),
-##            print "DCLOSY %6.3f (%6.3f)\n" % (dclosy,p95dclosy),
-##            print "DPREDY %6.3f (%6.3f)\n" % (dpredy,p95dpredy)
+            dpredy = np.sqrt(np.sum(squareErr[ip5],axis=1)/p5)
+            AD += dpredy>p95dpredy
 
-        return (True,sum(AD.values()))
+        return [(True,int(ad)) for ad in AD]
 
     def computeCI (self, ad):
         """Calculates a Reliability Index for the given prediction
@@ -1526,8 +2668,7 @@ class model:
         ci=0.0
 
         if ad<4:
-            model = pls ()
-            model.loadModel(self.vpath+'/modelPLS.npy')
+            model = self.getModelPLS ()
             ci = 1.96*model.SDEP[model.Av-1]
             if ad<2:
                 pass        # 0 or 1 criteria broken
@@ -1544,6 +2685,46 @@ class model:
         # default return values
         molPR=molCI=molAD=(False,0.0)
 
+        finished, result = self.predictPrepare (molFile, clean)
+        if finished:
+            return result
+
+        molMD = result
+
+        # MD are passed as copy because the scaling changes them and they
+        # need to be reused for computing the AD
+
+        success, pr = self.computePrediction (molMD.copy(),molCharge)
+        molPR = (success, pr)
+        if not success:
+            if clean: asMolecule(molFile).clean()
+            return (molPR,molAD,molCI)
+
+        if not self.confidential:
+            success, ad = self.computeAD (molMD.copy(), pr, detail)
+            if success :
+                molAD = (success, ad)
+                success, ci = self.computeCI (ad)
+                molCI = (success, ci)
+
+        if clean: asMolecule(molFile).clean()
+
+        return (molPR,molAD,molCI)
+
+    def predictPrepare (self, molFile, clean=True):
+        """Runs the part of the prediction protocol which does not need the model: returns the experimental
+           value or the value of the training series, when applicable, or computes the MD
+
+           The result is a tuple containing:
+           1) True/False: True when the prediction is finished
+           2) (if True ) The tuple of results returned by predict
+              (if False) The MD vector of the compound
+        """
+        # default return values
+        molPR=molCI=molAD=(False,0.0)
+
+        molFile = asMolecule (molFile)
+
         if self.experimental:
             success, result = self.checkExperimental (molFile)
 
@@ -1552,9 +2733,9 @@ class model:
                 molAD = (True, 0)            # no ADAN rules broken
                 molCI = (True, 0.0)          # CI is 0.0 wide
 
-                if clean: removefile(molFile)
+                if clean: molFile.clean()
 
-                return (molPR,molAD,molCI)
+                return (True, (molPR,molAD,molCI))
 
         if self.identity:
             success, result = self.checkIdentity (molFile)
@@ -1564,35 +2745,110 @@ class model:
                 molAD = (True, 0)            # no ADAN rules broken
                 molCI = (True, 0.0)          # CI is 0.0 wide
 
-                if clean: removefile(molFile)
+                if clean: molFile.clean()
 
-                return (molPR,molAD,molCI)
+                return (True, (molPR,molAD,molCI))
 
         success, molMD = self.computeMD (molFile)
         if not success:
             # this will not clean the mol, but on purpose, in case there is some
             # problem with this particular structure
-            return (molPR,molAD,molCI)
+            return (True, (molPR,molAD,molCI))
 
-        # MD are passed as copy because the scaling changes them and they
-        # need to be reused for computing the AD
+        return (False, molMD)
 
-        success, pr = self.computePrediction (molMD.copy(),molCharge)
-        molPR = (success, pr)
-        if not success:
-            if clean: removefile(molFile)
-            return (molPR,molAD,molCI)
+    def predictBatch (self, MD, charges, detail):
+        """Runs the model dependent part of the prediction protocol for all the compounds with MD vectors
+           in list MD, projecting them together in the model
 
+           Returns a list with the tuple of results returned by predict for every compound
+        """
+
+        PR = self.computePredictionBatch (MD, charges)
+
+        AD = [(False,0.0)]*len(MD)
         if not self.confidential:
-            success, ad = self.computeAD (molMD.copy(), pr, detail)
-            if success :
-                molAD = (success, ad)
-                success, ci = self.computeCI (ad)
+            # AD is computed only for the compounds successfully predicted
+            ipred = [i for i in range(len(MD)) if PR[i][0]]
+            ADp = self.computeADBatch ([MD[i] for i in ipred], [PR[i][1] for i in ipred], detail)
+            for i, ad in zip(ipred, ADp):
+                AD[i] = ad
+
+        results = []
+        for molPR, molAD in zip(PR, AD):
+            molCI=(False,0.0)
+            if molAD[0]:
+                success, ci = self.computeCI (molAD[1])
                 molCI = (success, ci)
+            else:
+                molAD=(False,0.0)
+            results.append ((molPR,molAD,molCI))
 
-        if clean: removefile(molFile)
+        return results
 
-        return (molPR,molAD,molCI)
+    def isBatchable (self):
+        """Returns True when the compounds can be predicted in chunks using predictBatch. This is not
+           possible when the model type has no batch projection or when the imodel overrides any of
+           the per-compound prediction methods
+        """
+
+        if self.model not in ['pls','RF']:
+            return False
+
+        for method in ['predict', 'computePrediction', 'computePredictionPLS', 'computePredictionRF',
+                       'computeAD', 'computeCI']:
+            if self.isOverridden (method):
+                return False
+
+        return True
+
+    def isOverridden (self, method):
+        """Returns True when the imodel overrides the method of this class with name "method"
+        """
+
+        return getattr(self.__class__, method).im_func is not getattr(model, method).im_func
+
+    def workerPool (self):
+        """Returns a pool of self.numWorkers processes, which are copies of this model. Every worker runs
+           in a private directory inside self.scratch, so this must be set up before calling this method
+        """
+        global workerModel
+
+        # the workers do not run in the current directory
+        self.vpath = os.path.abspath (self.vpath)
+
+        workerModel = self
+        return multiprocessing.Pool (self.numWorkers, initWorker, (self.scratch,))
+
+    def runSerialOrParallel (self, method, argList):
+        """Iterates over the results of calling the method with name "method" for every tuple of arguments
+           in argList. When self.numWorkers is larger than one, the calls are distributed over a pool of
+           worker processes. In all cases the results are returned in the same order than argList
+        """
+
+        if self.numWorkers < 2:
+            for margs in argList:
+                yield getattr(self, method)(*margs)
+            return
+
+        pool = self.workerPool ()
+        try:
+            for result, errors in pool.imap (runWorker, ((method, margs) for margs in argList)):
+                # the errors of every call are logged in the same order than the results
+                if errors:
+                    try:
+                        f = open (getErrorFile(),'a')
+                        f.write (errors)
+                        f.close()
+                    except:
+                        pass
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
 
 ##################################################################
 ##    EXTRACT METHODS
@@ -1618,12 +2874,10 @@ class model:
 
     def getSDFProperty (self, molFile, label):
         try:
-            suppl=Chem.SDMolSupplier(molFile)
+            mi = asMolecule(molFile).getMol()
         except:
             return (False, 'unable to open molfile')
 
-        mi = suppl.next()
-
         if mi is None:
             return (False, 'wrong input format')
 
@@ -1682,36 +2936,112 @@ class model:
         molMD=[]
         molActivity=0.0
 
+        molFile = asMolecule (molFile)
+
         try:
-            suppl = Chem.SDMolSupplier(molFile)
+            mol = molFile.getMol()
         except:
             return (False, 'unable to open molfile')
 
-        mol = suppl.next()
         if mol is None:
             return (False, 'wrong input format')
 
         success, molInChi = self.getInChi(mol)
         if not success:
-            return (False, molInChi + ' in ' + molFile)
+            return (False, molInChi + ' in ' + molFile.name)
 
         success, molMD = self.computeMD(molFile)
         if not success:
-            return (False, molMD + ' in ' + molFile)
+            return (False, molMD + ' in ' + molFile.name)
 
         success, molActivity = self.getBio(mol)
         if not success:
             if self.SDFileActivity != '':
-                return (False, molActivity + ' in ' + molFile)
+                return (False, molActivity + ' in ' + molFile.name)
 
         self.tdata.append( (molName,molInChi,molMD,molCharge,molActivity,molPos) )
 
         if clean:
-            removefile (molFile)
+            molFile.clean()
 
         return (True,'extraction OK')
 
 
+    def extractMol (self, i, molBlock):
+        """Runs the part of the build workflow which is independent for every compound: normalizes the
+           compound in molBlock, which is the compound i of the training series, and extracts its data
+
+           The result is a tuple containing:
+           1) True/False: describes the success of the normalization and extraction
+           2) (if True ) A tuple with the tdata row of the compound and the original and normalized molecules,
+                         both kept in memory
+              (if False) The error message
+        """
+
+        mol = molecule (self.scratch+'/m%0.10d.sdf' % i, molBlock)
+
+        return self.extractNormalized (i, mol, self.normalize (mol))
+
+    def extractMols (self, i, molBlocks):
+        """Runs extractMol for all the compounds in list molBlocks, the first one being the compound i of
+           the training series, processing them together in every external program
+
+           Returns a list with the results of extractMol for every compound
+        """
+
+        mols = [molecule (self.scratch+'/m%0.10d.sdf' % (i+k), molBlock) for k, molBlock in enumerate(molBlocks)]
+
+        normalized = self.normalizeBatch (mols)
+
+        # the MD are computed here together and found later by computeMD
+        if not self.isOverridden ('computeMD'):
+            self.computeMDBatch ([result[0] for success, result in normalized if success])
+
+        results = []
+        for k, mol in enumerate(mols):
+            results.append (self.extractNormalized (i+k, mol, normalized[k]))
+
+        self.mdBatch = {}
+
+        return results
+
+    def extractNormalized (self, i, mol, normalized):
+        """Extracts the data of the compound i of the training series, once normalized. Argument mol is the
+           original molecule and normalized the result of normalize
+
+           Returns a tuple like extractMol
+        """
+
+        success, result = normalized
+        if not success:
+            return (False, 'error in normalize: '+result)
+
+        molFile   = result[0]
+        molName   = result[1]
+        molCharge = result[2]
+
+        # extract appends the data of the compound to self.tdata, so it is collected in an empty list
+        tdata = self.tdata
+        self.tdata = []
+        try:
+            success, infN = self.extract (molFile,molName,molCharge,i)
+            row = self.tdata
+        finally:
+            self.tdata = tdata
+
+        if not success:
+            infN = str(infN)
+            infN = infN.replace('\n','')
+            return (False, 'error in extract: '+ infN)
+
+        # the normalized structure is needed for tstruct.sdf
+        molFile.getBlock()
+
+        mol.clean()
+        molFile.clean()
+
+        return (True, (row[0], mol, molFile))
+
     def extractView (self, molFile, molName, molCharge, molPos, clean=True):
         """Process the compound "mol" for obtaining
            2) Molecular Descriptors (NumPy float64 array)
@@ -1723,10 +3053,7 @@ class model:
         molMD=[]
         molActivity=0.0
 
-        try:
-            suppl = Chem.SDMolSupplier(molFile)
-        except:
-            return (False, 'unable to open molfile')
+        molFile = asMolecule (molFile)
 
         if self.viewType == 'property':
             success, molMD = self.computeMDlogpmw(molFile)
@@ -1734,12 +3061,12 @@ class model:
             success, molMD = self.computeMD(molFile)
 
         if not success:
-            return (False, molMD + ' in ' + molFile)
+            return (False, molMD + ' in ' + molFile.name)
 
         self.tdata.append( (molName,molInChi,molMD,molCharge,molActivity,molPos) )
 
         if clean:
-            removefile (molFile)
+            molFile.clean()
 
         return (True,'extraction OK')
 
@@ -1756,6 +3083,11 @@ class model:
     def getMatrices (self):
         """ Returns NumPy X and Y matrices extracted from tdata. In case of Pentacle MD, it also adjusts the X vectors
         """
+
+        # data stored by columns is copied as a whole
+        if isinstance (self.tdata, tdatastore) and self.tdata.isRectangular() and not 'pentacle' in self.MD:
+            return np.array(self.tdata.X), np.array(self.tdata.activities)
+
         ncol = 0
         xx = []
         yy = []
@@ -1783,6 +3115,11 @@ class model:
     def getMatrix (self):
         """ Returns NumPy X and Y matrices extracted from tdata. In case of Pentacle MD, it also adjusts the X vectors
         """
+
+        # data stored by columns is copied as a whole
+        if isinstance (self.tdata, tdatastore) and self.tdata.isRectangular() and not 'pentacle' in self.MD:
+            return np.array(self.tdata.X)
+
         ncol = 0
         xx = []
 
@@ -1878,7 +3215,7 @@ class model:
 
                     model.build (X,Y,self.modelLV,autoscale=self.modelAutoscaling)
 
-                    model.validateLOO(self.modelLV)
+                    self.validatePLS (model)
 
                     for i in range (self.modelLV):
 ##                       print 'LV%2d R2:%5.3f Q2:%5.3f SDEP:%7.3f' % \
@@ -1899,7 +3236,8 @@ class model:
                 if iRuns > 0:
                     model = pls()
 
-                res, nexcluded = model.varSelectionFFD (X,Y,self.selVarLV,self.modelAutoscaling)
+                res, nexcluded = model.varSelectionFFD (X,Y,self.selVarLV,self.modelAutoscaling,
+                                                        numWorkers=self.numWorkers, stopBlocks=self.selVarStop)
                 X = model.excludeVar (X, res)
                 self.selVarMask = res
 
@@ -1910,7 +3248,7 @@ class model:
 
                 model.build (X,Y,self.modelLV,autoscale=self.modelAutoscaling)
 
-                model.validateLOO(self.modelLV)
+                self.validatePLS (model)
 
                 for i in range (self.modelLV):
 ##                   print 'LV%2d R2:%5.3f Q2:%5.3f SDEP:%7.3f' % \
@@ -1947,6 +3285,33 @@ class model:
         self.infoModel.append( ('LV', self.modelLV ))
         return model
 
+    def getPLSCrossVal (self):
+        """ Returns the sklearn splitter defined by ModelValidationCV, ModelValidationN and ModelValidationP
+            for cross-validating PLS models, or None when the models are validated by LOO
+        """
+
+        if self.ModelValidationCV in [None, 'loo']:
+            return None
+
+        cv = getCrossVal(self.ModelValidationCV, 1226, self.ModelValidationN, self.ModelValidationP)
+        if cv is None:
+            print 'unknown cross-validation method %s, using LOO' % self.ModelValidationCV
+
+        return cv
+
+    def validatePLS (self, model):
+        """ Cross-validates the PLS model provided as argument with the method defined by ModelValidationCV
+            (LOO by default), using numWorkers processes
+
+            Returns the experimental and predicted Y values. The results (SSY, SDEP and Q2) are stored in the model
+        """
+
+        cv = self.getPLSCrossVal ()
+        if cv is None:
+            return model.validateLOO(self.modelLV, numWorkers=self.numWorkers)
+
+        return model.validateCV(self.modelLV, cv, numWorkers=self.numWorkers)
+
     def diagnosePLS_R (self, model):
         """ Runs CV diagnostic on the PLS-R model provided as argument
 
@@ -1963,7 +3328,7 @@ class model:
             model.X = model.excludeVar (model.X, self.selVarMask)
             #model.build (X,Y,self.modelLV,autoscale=self.modelAutoscaling)
 
-        yp = model.validateLOO(self.modelLV)
+        yp = self.validatePLS (model)
         for i in range (self.modelLV):
 ##            print 'LV%2d R2:%5.3f Q2:%5.3f SDEP:%7.3f' % \
 ##                  (i+1,model.SSYac[i],model.Q2[i],model.SDEP[i])
@@ -2058,7 +3423,7 @@ class model:
 
 
         print 'cross-validating...'
-        yp = model.predConfussion()
+        yp = model.predConfussion(cv=self.getPLSCrossVal(), numWorkers=self.numWorkers)
 
         for i in range (self.modelLV):
             sensp = sensitivity(model.TPpred[i],model.FNpred[i])
@@ -2246,81 +3611,68 @@ class model:
             T[:,a]=ta
             centx[a]=np.mean(ta)
 
-        i95 = np.round(nrows*0.95)-1
+        i95 = int(np.round(nrows*0.95))-1
+
         # compute distances to X centroid (A) and percentil 95
-        for i in range(nrows):
-            dcentx[i] = np.sqrt(np.sum(np.square(centx-T[i,:])))
+        dcentx = np.sqrt(np.sum(np.square(centx-T),axis=1))
+        p95dcentx = np.partition(dcentx,i95)[i95]
 
-        dcentx = np.sort(dcentx)
-        p95dcentx = dcentx[i95]
+        # the closer compounds used by criteria B, E and F are obtained from blocks of rows of the matrix of
+        # pairwise distances, limiting the size of every block to keep the memory used bounded
+        p5 = int(np.round(nrows*0.05))
+        if p5 < 1 : p5 = 1
 
-        # compute closer distances in X (B) and percentil 95
-        for i in range (nrows):
-            dclosx[i]=1e20
-            closj=0
-            for j in range (nrows):
-                if j != i:
-                    dtemp = np.sqrt(np.sum(np.square(T[j,:]-T[i,:])))
-                    if dtemp < dclosx[i] :
-                        dclosx[i] = dtemp
-                        closj = j
-            dclosy[i]=np.abs(Y[i]-Y[closj])
-
-        dclosx = np.sort(dclosx)
-        p95dclosx = dclosx[i95]
+        squareErr = np.empty(nrows,dtype=np.float64)
+        if self.quantitative:
+            squareErr = np.square(Y-yp)
+
+        nblock = max(1, int(4.0e6/(nrows*nlv)))
+
+        for i0 in range (0, nrows, nblock):
+            i1 = min (i0+nblock, nrows)
+            irow = np.arange(i1-i0)
+
+            # squared distances from compounds i0 to i1 to all the compounds, excluding themselves
+            dblock = np.sum(np.square(T[np.newaxis,:,:]-T[i0:i1,np.newaxis,:]),axis=2)
+            dblock[irow,irow+i0] = np.inf
+
+            # compute closer distances in X (B) and Y of the closer compound (E)
+            closj = np.argmin(dblock,axis=1)
+            dclosx[i0:i1] = np.sqrt(dblock[irow,closj])
+            dclosy[i0:i1] = np.abs(Y[i0:i1]-Y[closj])
+
+            # compute SDEP of 5% closer neighbours (F)
+            if self.quantitative:
+                closerj = np.argpartition(dblock,p5-1,axis=1)[:,:p5]
+                dpredy[i0:i1] = np.sqrt(np.sum(squareErr[closerj],axis=1)/float(p5))
+
+        # percentil 95 of closer distances in X (B)
+        p95dclosx = np.partition(dclosx,i95)[i95]
 
         # compute DModX (C) and percentil 95
         dmodx = np.array(model.dmodx[-1])
-        dmodx = np.sort(dmodx)
-        p95dmodx=dmodx[i95]
+        p95dmodx = np.partition(dmodx,i95)[i95]
 
         # compute distance to Y centroid (D) and percentil 95
         if self.quantitative:
             centy = np.mean(Y)
             dcenty = np.abs(Y-centy)
-            dcenty = np.sort(dcenty)
-            p95dcenty = dcenty[i95]
+            p95dcenty = np.partition(dcenty,i95)[i95]
         else:
             centy = 0.0
             p95dcenty = 0.0
 
-        # compute Y of the closer compound (E) and percentil 95
+        # percentil 95 of Y of the closer compound (E)
         if self.quantitative:
-            dclosy = np.sort(dclosy)
-            p95dclosy = dclosy[i95]
+            p95dclosy = np.partition(dclosy,i95)[i95]
         else:
             p95dclosy = 0.0
 
-        # compute SDEP of 5% closer neighbours (F) and percentil 95
+        # percentil 95 of SDEP of 5% closer neighbours (F)
         if self.quantitative:
-            p5 = int(np.round(nrows*0.05))
-            if p5 < 1 : p5 = 1
-
-            closerDis = np.empty(p5,dtype=np.float64)
-            closerErr = np.empty(p5,dtype=np.float64)
-            squareErr = np.empty(nrows,dtype=np.float64)
-            squareErr = np.square(Y-yp)
-
-            for i in range (nrows):
-
-                closerDis.fill(1e20)
-
-                for j in range (nrows):
-                    if j != i:
-                        dtemp = np.sum(np.square(T[j,:]-T[i,:]))
-                        if dtemp < np.amax(closerDis) :
-                            imindis=np.argmax(closerDis)
-                            closerDis[imindis] = dtemp
-                            closerErr[imindis] = squareErr[j]
-
-                dpredy[i]=np.sqrt(np.sum(closerErr)/float(p5))
-
-            dpredy = np.sort(dpredy)
-
-            p95dpredy = dpredy[i95]
+            p95dpredy = np.partition(dpredy,i95)[i95]
         else:
             # TODO: the values in yp can be used to compute criteria G (equivalent to F)
-            squareErr = np.empty(nrows,dtype=np.float64)
             p95dpredy = 0.0
 
 
@@ -2332,19 +3684,14 @@ class model:
 ##        print "DPREDY %6.3f \n" % (p95dpredy)
 
         # write in a file, Am -> critical distances -> centroid -> t
-        f = file (self.vpath+'/tscores.npy','wb')
-        np.save(f,nlv)
-        np.save(f,p95dcentx)
-        np.save(f,p95dclosx)
-        np.save(f,p95dmodx)
-        np.save(f,p95dcenty)
-        np.save(f,p95dclosy)
-        np.save(f,p95dpredy)
-        np.save(f,centx)
-        np.save(f,centy)
-        np.save(f,T)
-        np.save(f,Y)
-        np.save(f,squareErr)
+        saveModelFile (self.vpath+'/tscores.npy', 'tscores',
+                       {'nlv': nlv, 'p95dcentx': p95dcentx, 'p95dclosx': p95dclosx, 'p95dmodx': p95dmodx,
+                        'p95dcenty': p95dcenty, 'p95dclosy': p95dclosy, 'p95dpredy': p95dpredy,
+                        'centx': centx, 'centy': centy, 'T': T, 'Y': Y, 'squareErr': squareErr})
+
+        # save a KD-tree index of the scores, used to find the closest compounds of query compounds
+        f = open (self.vpath+'/tscores-tree.pkl','wb')
+        pickle.dump(KDTree(T), f, pickle.HIGHEST_PROTOCOL)
         f.close()
 
         return (True, "Model OK")
@@ -2360,6 +3707,7 @@ class model:
 
         preserve = ['imodel.py',
                     'distiledPLS.txt',
+                    'compiledPLS.npy',
                     'info.pkl']
 
         if self.MD == 'padel' and self.padelDescriptor:
@@ -2404,6 +3752,9 @@ class model:
             else:
                 model.saveModel (self.vpath+'/modelPLS.npy')
 
+            # compiled version of the model, used for predicting new compounds
+            model.saveCompiled (self.vpath+'/compiledPLS.npy')
+
             if self.confidential:
                 self.cleanConfidentialFiles()
                 return (True, 'Confidential Model OK')
@@ -2821,14 +4172,18 @@ class model:
 
             # estimate number of molecules inside the SDFile
             nmol = 0
+            digest = hashlib.md5()
             try:
                 f = open (self.vpath+'/training.sdf','r')
             except:
                 return (False,"Unable to open file %s" % molecules)
             for line in f:
+                digest.update (line)
                 if '$$$$' in line: nmol+=1
             f.close()
 
+            series = digest.hexdigest()
+
             if not nmol:
                 return (False,"No molecule found in %s:  SDFile format not recognized" % molecules)
 
@@ -2844,70 +4199,109 @@ class model:
                 ## the MD will be loaded into a dictionary for faster access
                 self.preloadMDexternal()
 
-            i = 0
-            fout = None
-            mol = ''
+            # an interrupted build of the same series is resumed after the last compound checkpointed
+            done, rows, digests = self.loadCheckpoint (series)
+
+            # the errors found extracting the series are collected in the model directory and added to the
+            # error log when the extraction is complete, so those of the compounds extracted again after
+            # resuming the build are not repeated (see saveCheckpoint)
+            errorLog = getErrorFile ()
+            if not done:
+                removefile (self.vpath+'/build-error.log')
+
+            i = done
+
+            # in incremental builds the data of the compounds of the previous series is reused
+            previous = None
+            if molecules and self.buildIncremental and not done:
+                previous = self.loadPrevious ()
+
+            self.tdata = rows
+            self.tdigest = digests
 
             # open SDFfile and iterate for every molecule
             f = open (self.vpath+'/training.sdf','r')
 
-            # clean normalized structures
-            removefile (self.vpath+'/tstruct.sdf')
+            # the molecules are kept in memory and written, only when needed, to a private directory
+            self.scratch = scratchDir ()
+
+            # clean normalized structures, unless they belong to the compounds already processed
+            if not done:
+                removefile (self.vpath+'/tstruct.sdf')
 
             updateProgress (0.0)
 
             # trick to avoid RDKit dumping warnings to the console
             stderr_fileno = sys.stderr.fileno()       # saves current syserr
             stderr_save = os.dup(stderr_fileno)
-            stderr_fd = open('errorRDKit.log', 'w')   # open a specific RDKit log file
+            stderr_fd = open(self.scratchFile ('errorRDKit.log'), 'w')   # open a specific RDKit log file
             os.dup2(stderr_fd.fileno(), stderr_fileno)
 
-            for line in f:
-                if not fout or fout.closed:
-                    i += 1
-                    mol = 'm%0.10d.sdf' % i
-                    fout = open(mol, 'w')
+            # only new or modified compounds are extracted in incremental builds
+            source = islice (readSDF (f), done, None)
+            if previous is not None:
+                plan, source = self.planIncremental (source, previous)
 
-                fout.write(line)
+            setErrorFile (os.path.abspath (self.vpath+'/build-error.log'))
+            try:
+                # the compounds are normalized and their MD computed serially or, if numWorkers is larger than
+                # one, in parallel. Anyway, the results are collected and stored in the order of the SDFile
+                if self.toolChunk > 1:
+                    # the external programs process together chunks of toolChunk compounds
+                    argList = enumerateChunks (source, self.toolChunk, done+1)
+                    results = chain.from_iterable (self.runSerialOrParallel ('extractMols', argList))
+                else:
+                    argList = ((j, molBlock) for j, molBlock in enumerate(source,done+1))
+                    results = self.runSerialOrParallel ('extractMol', argList)
 
-                if '$$$$' in line:
-                    fout.close()
+                if previous is not None:
+                    results = self.mergeIncremental (plan, results)
+
+                for success, result in results:
+                    i += 1
 
                     ## workflow for molecule i (mol) ############
-                    success, result = self.normalize (mol)
                     if not success:
-                       writeError('error in normalize: '+result)
-                       continue
+                        writeError(result)
+                    else:
+                        row, mol, molFile = result
 
-                    molFile   = result[0]
-                    molName   = result[1]
-                    molCharge = result[2]
+                        self.tdata.append (row)
+                        self.tdigest.append (mol.getDigest())
 
-                    success, infN = self.extract (molFile,molName,molCharge,i)
-                    if not success:
-                        infN = str(infN)
-                        infN = infN.replace('\n','')
-                        writeError('error in extract: '+ infN)
-                        continue
+                        if not self.saveNormalizedMol(mol, molFile):
+                            writeError('unable to save '+ row[0] + 'in the tstruct.sdf file' )
 
-                    if not self.saveNormalizedMol(mol, molFile):
-                        writeError('unable to save '+ molName + 'in the tstruct.sdf file' )
-                    
-                    updateProgress (float(i)/float(nmol))
-                    ##############################################
+                        updateProgress (float(i)/float(nmol))
 
-                    removefile (mol)
-                    removefile (molFile)
+                    if self.buildCheckpoint and not i % self.buildCheckpoint:
+                        self.saveCheckpoint (series, i)
+                    ##############################################
+            finally:
+                setErrorFile (errorLog)
 
             f.close()
-            if fout :
-                fout.close()
 
-            self.saveData ()
+            try:
+                appendFile (self.vpath+'/build-error.log', errorLog)
+            except:
+                pass
+            removefile (self.vpath+'/build-error.log')
 
             stderr_fd.close()                     # close the RDKit log
             os.dup2(stderr_save, stderr_fileno)   # restore old syserr
 
+            self.keepScratchFile ('errorRDKit.log')
+
+            removefile (self.scratch)
+            self.scratch = None
+
+            self.saveData ()
+
+            # the data is complete, so the checkpoint is no longer needed
+            removefile (self.vpath+'/checkpoint')
+            self.checkpoint = None
+
         # build the model with the datList stored data
 
         success, result = self.build ()
@@ -2921,22 +4315,236 @@ class model:
         return (result)
 
 
+    def saveCheckpoint (self, series, nrec):
+        """Saves the progress of the extraction of the training series (identified by the digest "series")
+           after processing its first nrec compounds, so an interrupted build can be resumed (see loadCheckpoint)
+
+           The tdata rows extracted since the last checkpoint are saved in a new part file (see tdatastore),
+           together with the normalized structures appended to tstruct.sdf, which could be removed before the
+           build is resumed (e.g. by build.py), and the errors appended to build-error.log. Then the state file,
+           listing the parts, is replaced
+        """
+
+        # the data of confidential models is never written to disk
+        if self.confidential:
+            return
+
+        cpath = self.vpath+'/checkpoint'
+
+        state = self.checkpoint
+        if state is None:
+            removefile (cpath)
+            state = {'parts': [], 'rows': 0, 'tstruct': 0, 'errors': 0}
+
+        settings = StringIO()
+        self.saveSettings (settings)
+
+        first = state['rows']
+        part = 'part%0.6d' % len(state['parts'])
+
+        try:
+            if not os.path.isdir (cpath):
+                os.mkdir (cpath)
+
+            storeRows (self.tdata[first:], self.tdigest[first:]).save (cpath+'/'+part+'.npz', settings.getvalue())
+
+            # a former attempt to save this part could have failed
+            removefile (cpath+'/'+part+'.sdf')
+            removefile (cpath+'/'+part+'.err')
+
+            tstructSize = appendFile (self.vpath+'/tstruct.sdf', cpath+'/'+part+'.sdf', state['tstruct'])
+            errorsSize = appendFile (self.vpath+'/build-error.log', cpath+'/'+part+'.err', state['errors'])
+
+            newState = {'series': series,
+                        'nrec': nrec,
+                        'parts': state['parts']+[part],
+                        'rows': len(self.tdata),
+                        'tstruct': tstructSize,
+                        'errors': errorsSize}
+
+            # the state is replaced only when complete, so the last checkpoint remains valid otherwise
+            f = open (cpath+'/state.pkl.tmp','wb')
+            self.saveSettings (f)
+            pickle.dump (newState, f)
+            f.close()
+            os.rename (cpath+'/state.pkl.tmp', cpath+'/state.pkl')
+        except:
+            return
+
+        self.checkpoint = newState
+
+    def loadCheckpoint (self, series):
+        """Loads the checkpoint saved by an interrupted build of the same training series (identified by the
+           digest "series") using the same settings. tstruct.sdf and build-error.log are rebuilt from the normalized
+           structures and errors saved with the checkpoint, discarding those of the compounds processed after it
+
+           Returns a tuple with the number of compounds of the series already processed and the lists of their
+           tdata rows and digests. Checkpoints which cannot be used are removed, returning (0, [], [])
+        """
+
+        self.checkpoint = None
+
+        cpath = self.vpath+'/checkpoint'
+        tstruct = self.vpath+'/tstruct.sdf'
+        errors = self.vpath+'/build-error.log'
+
+        if self.confidential or not os.path.isfile (cpath+'/state.pkl'):
+            removefile (cpath)
+            return (0, [], [])
+
+        state = None
+        rows = []
+        digests = []
+        try:
+            f = open (cpath+'/state.pkl','rb')
+            if self.checkSettings (f):
+                state = pickle.load (f)
+            f.close()
+
+            if state is not None and state['series'] == series:
+                fs = open (tstruct+'.tmp','wb')
+                fe = open (errors+'.tmp','wb')
+                for part in state['parts']:
+                    settings, store = loadStore (cpath+'/'+part+'.npz')
+                    rows += list(store)
+                    digests += store.digests
+
+                    for name, fo in [(part+'.sdf', fs), (part+'.err', fe)]:
+                        fi = open (cpath+'/'+name,'rb')
+                        shutil.copyfileobj (fi, fo)
+                        fi.close()
+                fs.close()
+                fe.close()
+        except:
+            state = None
+
+        if state is None or state['series'] != series or len(rows) != state['rows']:
+            removefile (tstruct+'.tmp')
+            removefile (errors+'.tmp')
+            removefile (cpath)
+            return (0, [], [])
+
+        # tstruct.sdf is replaced only now, since incremental builds use it when the checkpoint is not valid
+        try:
+            os.rename (tstruct+'.tmp', tstruct)
+            os.rename (errors+'.tmp', errors)
+        except:
+            removefile (tstruct+'.tmp')
+            removefile (errors+'.tmp')
+            removefile (cpath)
+            return (0, [], [])
+
+        self.checkpoint = state
+
+        print 'build resumed after compound %d, from the last checkpoint' % state['nrec']
+        writeError ('build of %s resumed after compound %d, from the last checkpoint' % (self.vpath, state['nrec']))
+
+        return (state['nrec'], rows, digests)
+
+    def loadPrevious (self):
+        """Loads the data extracted from the previous training series, for an incremental build
+
+           Returns a dictionary with the digest of the SDFile record of the compounds (see molecule.getDigest)
+           as key and a list of tuples with their tdata row and normalized structure, in order, as value.
+           None is returned when the data was not stored or was extracted using different settings
+        """
+
+        if not self.loadData ():
+            return None
+
+        store = self.tdata
+        self.tdata = []
+
+        # data stored by older versions does not identify the SDFile records
+        if not isinstance (store, tdatastore) or '' in store.digests:
+            return None
+
+        try:
+            f = open (self.vpath+'/tstruct.sdf','r')
+            blocks = list(readSDF (f))
+            f.close()
+        except:
+            return None
+
+        # the normalized structures must correspond to the rows
+        if len(blocks) != len(store):
+            return None
+
+        previous = {}
+        for k in range (len(store)):
+            previous.setdefault (store.digests[k], []).append ((store[k], blocks[k]))
+
+        return previous
+
+    def planIncremental (self, molBlocks, previous):
+        """Compares the compounds of the series in molBlocks with those of the previous series (see loadPrevious)
+
+           Returns a tuple with
+           1) a list with, for every compound of the series, its molBlock and the data of the previous series
+              (its tdata row and normalized structure) or None if the compound is new or was modified
+           2) the list of molBlocks of the compounds which must be extracted
+        """
+
+        plan = []
+        pending = []
+
+        for molBlock in molBlocks:
+            old = previous.get (molecule ('', molBlock).getDigest())
+            if old:
+                plan.append ((molBlock, old.pop(0)))
+            else:
+                plan.append ((None, None))
+                pending.append (molBlock)
+
+        print 'incremental build: %d compounds reused, %d extracted' % (len(plan)-len(pending), len(pending))
+
+        return (plan, pending)
+
+    def mergeIncremental (self, plan, results):
+        """Iterates over the compounds of an incremental build (see planIncremental), returning results like
+           extractMol: the data of the previous series for the compounds reused and the next item of results,
+           which contains those of the compounds extracted, for the rest
+        """
+
+        for j, (molBlock, old) in enumerate(plan,1):
+            if old is None:
+                success, result = next(results)
+            else:
+                row, normBlock = old
+                success = True
+                result = (row, molecule (self.scratch+'/r%0.10d.sdf' % j, molBlock),
+                          molecule (self.scratch+'/t%0.10d.sdf' % j, normBlock))
+
+            if success:
+                row, mol, molFile = result
+
+                # the position of the compound in the new series
+                result = (tuple(row[:5])+(j,), mol, molFile)
+
+            yield (success, result)
+
     def predictWorkflow(self, molecules, detail, progress, extValid=False):
 
         success, result = self.licenseTesting ()
         if not success: return (False, result)
 
-        datList = []
-        datList = self.loadData ()
+        # the identity of the compounds is checked using only the InChiKey index of the training series
+        self.tindex = None
+        if self.identity:
+            self.loadIdentityIndex ()
+
+        # load the model artifacts only once for the whole series
+        self.loadPredictionContext ()
+
+        # the MD of the compounds are collected and projected together in chunks
+        batch = self.isBatchable ()
+        chunk = []
 
         i=0
         pred = []   # predicted Y values
         orig = []   # original Y values, collected only if present
         mnam = []   # molecular name
 
-        mol=''
-        fout = None
-
         if self.MD == 'external':
             ## note that in the prediction workflow the external data table is NOT updated, the
             ## one used at building stage will be used. For new compounds, the MD can also be
@@ -2951,61 +4559,73 @@ class model:
         except:
             return (False,"No molecule found in %s; SDFile format not recognized" % molecules)
 
+        # the molecules are kept in memory and written, only when needed, to a private directory
+        self.scratch = scratchDir ()
+
         # trick to avoid RDKit dumping warnings to the console
         stderr_fileno = sys.stderr.fileno()       # saves current syserr
         stderr_save = os.dup(stderr_fileno)
-        stderr_fd = open('errorRDKit.log', 'w')   # open a specific RDKit log file
+        stderr_fd = open(self.scratchFile ('errorRDKit.log'), 'w')   # open a specific RDKit log file
         os.dup2(stderr_fd.fileno(), stderr_fileno)
 
-        for line in f:
-            if not fout or fout.closed:
-                i += 1
-                mol = 'm%0.10d.sdf' % i
-                fout = open(mol, 'w')
-
-            fout.write(line)
+        # the compounds are normalized and predicted (or their MD computed) serially or, if numWorkers
+        # is larger than one, in parallel. Anyway, the results are collected in the order of the SDFile
+        if self.toolChunk > 1:
+            # the external programs process together chunks of toolChunk compounds
+            argList = ((j, molBlocks, detail, extValid, batch) for j, molBlocks in enumerateChunks (readSDF (f), self.toolChunk))
+            results = chain.from_iterable (self.runSerialOrParallel ('predictMols', argList))
+        else:
+            argList = ((j, molBlock, detail, extValid, batch) for j, molBlock in enumerate(readSDF (f),1))
+            results = self.runSerialOrParallel ('predictMol', argList)
 
-            if '$$$$' in line:
-                fout.close()
+        for success, result in results:
+            i += 1
 
-                ## workflow for molecule i (mol) ###########
-                success, result  = self.normalize (mol)
-                if not success:
-                    pred.append((False, result))
-                    continue
+            ## workflow for molecule i (mol) ###########
+            if not success:
+                pred.append((False, result))
+                continue
 
-                molFile   = result[0]
-                molName   = result[1]
-                molCharge = result[2]
+            molName, molCharge, origY, finished, result = result
 
-                mnam.append (molName)
+            mnam.append (molName)
 
-                # obtain Y values present in the query file for external validation
-                if extValid:
-                    try:
-                        suppl = Chem.SDMolSupplier(molFile)
-                        origY = self.getBio(suppl.next())
-                        orig.append (origY)
-                    except:
-                        pass
+            # obtain Y values present in the query file for external validation
+            if origY is not None:
+                orig.append (origY)
 
-                # predict
-                predN = self.predict (molFile, molName, molCharge, detail)
-                pred.append((True, predN))
+            # predict
+            if finished:
+                pred.append((True, result))
+            else:
+                # the place in pred is reserved, and filled when the chunk is projected
+                pred.append(None)
+                chunk.append((len(pred)-1, i, result, molCharge))
+                if len(chunk) >= self.predChunk:
+                    self.predictChunk (chunk, pred, detail, progress)
+                    chunk = []
+                continue
 
-                # show progress (optional)
-                if progress:
-                    sys.stdout.write('completed: %d\n'%i)
-                    sys.stdout.flush()
+            # show progress (optional)
+            if progress:
+                sys.stdout.write('completed: %d\n'%i)
+                sys.stdout.flush()
 
-                ############################################
+            ############################################
 
-                removefile(mol)
+        if chunk:
+            self.predictChunk (chunk, pred, detail, progress)
 
+        f.close()
 
         stderr_fd.close()                     # close the RDKit log
         os.dup2(stderr_save, stderr_fileno)   # restore old syserr
 
+        self.keepScratchFile ('errorRDKit.log')
+
+        removefile (self.scratch)
+        self.scratch = None
+
         if extValid:
             if self.quantitative :
                 self.extValidateQuantitative(orig, pred, mnam)
@@ -3015,6 +4635,111 @@ class model:
         return (True, pred)
 
 
+    def predictMol (self, i, molBlock, detail, extValid, batch):
+        """Runs the part of the prediction workflow which is independent for every compound: normalizes
+           the compound in molBlock, which is the compound i of the SDFile, and predicts it or, if batch is
+           True, computes its MD for projecting it later in a chunk
+
+           The result is a tuple containing:
+           1) True/False: describes the success of the normalization
+           2) (if True ) A tuple with the molecule name, its formal charge, the Y value present in the
+                         query file (None if not collected), a flag indicating if the prediction is
+                         finished and either the result of predict or the MD of the compound
+              (if False) The error mesage
+        """
+
+        mol = molecule (self.scratch+'/m%0.10d.sdf' % i, molBlock)
+
+        return self.predictNormalized (mol, self.normalize (mol), detail, extValid, batch)
+
+    def predictMols (self, i, molBlocks, detail, extValid, batch):
+        """Runs predictMol for all the compounds in list molBlocks, the first one being the compound i of
+           the SDFile, processing them together in every external program
+
+           Returns a list with the results of predictMol for every compound
+        """
+
+        mols = [molecule (self.scratch+'/m%0.10d.sdf' % (i+k), molBlock) for k, molBlock in enumerate(molBlocks)]
+
+        normalized = self.normalizeBatch (mols)
+
+        # the MD are computed here together, only for the compounds which need them, and found later by computeMD
+        if not self.isOverridden ('computeMD') and not self.isOverridden ('predict'):
+            self.computeMDBatch ([result[0] for success, result in normalized if success and self.needsMD (result[0])])
+
+        results = []
+        for k, mol in enumerate(mols):
+            results.append (self.predictNormalized (mol, normalized[k], detail, extValid, batch))
+
+        self.mdBatch = {}
+
+        return results
+
+    def needsMD (self, molFile):
+        """Returns False when the MD of the normalized compound molFile are not needed for predicting it,
+           because predictPrepare will return its experimental value or the value in the training series
+        """
+
+        if self.experimental and self.checkExperimental (molFile)[0]:
+            return False
+
+        if self.identity and self.checkIdentity (molFile)[0]:
+            return False
+
+        return True
+
+    def predictNormalized (self, mol, normalized, detail, extValid, batch):
+        """Predicts the compound once normalized. Argument mol is the original molecule and normalized the
+           result of normalize
+
+           Returns a tuple like predictMol
+        """
+
+        success, result = normalized
+        if not success:
+            return (False, result)
+
+        molFile   = result[0]
+        molName   = result[1]
+        molCharge = result[2]
+
+        # obtain Y values present in the query file for external validation
+        origY = None
+        if extValid:
+            try:
+                origY = self.getBio(molFile.getMol())
+            except:
+                pass
+
+        if batch:
+            finished, result = self.predictPrepare (molFile)
+            if not finished:
+                molFile.clean()
+        else:
+            # imodels overriding predict expect the name of a file
+            if self.isOverridden ('predict'):
+                molFile = molFile.getFile()
+            finished, result = True, self.predict (molFile, molName, molCharge, detail)
+
+        mol.clean()
+
+        return (True, (molName, molCharge, origY, finished, result))
+
+    def predictChunk (self, chunk, pred, detail, progress):
+        """Projects together the compounds in chunk, a list of tuples (position in pred, position in the
+           SDFile, MD, charge), storing the results in the reserved positions of list pred
+        """
+
+        results = self.predictBatch ([c[2] for c in chunk], [c[3] for c in chunk], detail)
+
+        for c, predN in zip (chunk, results):
+            pred[c[0]] = (True, predN)
+
+            # show progress (optional)
+            if progress:
+                sys.stdout.write('completed: %d\n'%c[1])
+                sys.stdout.flush()
+
     def viewWorkflow(self, molecules):
 
         success, result = self.licenseTesting ()
@@ -3052,51 +4777,45 @@ class model:
                 return (False,"No molecule found in %s:  SDFile format not recognized" % molecules)
 
             i = 0
-            fout = None
-            mol = ''
 
             # open SDFfile and iterate for every molecule
             f = open (molecules,'r')
 
-            updateProgress (0.0)
-
-            for line in f:
-                if not fout or fout.closed:
-                    i += 1
-                    mol = 'm%0.10d.sdf' % i
-                    fout = open(mol, 'w')
+            # the molecules are kept in memory and written, only when needed, to a private directory
+            self.scratch = scratchDir ()
 
-                fout.write(line)
+            updateProgress (0.0)
 
-                if '$$$$' in line:
-                    fout.close()
+            for molBlock in readSDF (f):
+                i += 1
+                mol = molecule (self.scratch+'/m%0.10d.sdf' % i, molBlock)
 
-                    ## workflow for molecule i (mol) ############
-                    success, result = self.normalize (mol)
-                    if not success:
-                       writeError('error in normalize: '+result)
-                       continue
+                ## workflow for molecule i (mol) ############
+                success, result = self.normalize (mol)
+                if not success:
+                   writeError('error in normalize: '+result)
+                   continue
 
-                    molFile   = result[0]
-                    molName   = result[1]
-                    molCharge = result[2]
+                molFile   = result[0]
+                molName   = result[1]
+                molCharge = result[2]
 
-                    success, infN = self.extractView (molFile,molName,molCharge,i)
-                    if not success:
-                        infN = str(infN)
-                        infN = infN.replace('\n','')
-                        writeError('error in extract: '+ infN)
-                        continue
+                success, infN = self.extractView (molFile,molName,molCharge,i)
+                if not success:
+                    infN = str(infN)
+                    infN = infN.replace('\n','')
+                    writeError('error in extract: '+ infN)
+                    continue
 
-                    updateProgress (float(i)/float(nmol))
-                    ##############################################
+                updateProgress (float(i)/float(nmol))
+                ##############################################
 
-                    removefile (mol)
+                mol.clean()
 
             f.close()
 
-            if fout :
-                fout.close()
+            removefile (self.scratch)
+            self.scratch = None
 
             # save results only for propety data and series mode
             if (self.viewMode=='series') and (self.viewType == 'property'):
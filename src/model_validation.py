@@ -108,6 +108,7 @@ def getCrossVal(cv, rs, n, p):
     ###Splitter Classes:
 
     kfold = KFold(n_splits=n, random_state=rs, shuffle=False)                             ### K-Folds cross-validator
+    rkfold = RepeatedKFold(n_splits=n, n_repeats=max(int(p),1), random_state=rs)          ### Repeated K-Folds cross-validator (p repeats)
     gkfold = GroupKFold(n_splits=n)                                                       ### K-fold iterator variant with non-overlapping groups.
     stkfold = StratifiedKFold(n_splits=n, random_state=rs, shuffle=False)                 ### Stratified K-Folds cross-validator
     logo = LeaveOneGroupOut()                                                             ### Leave One Group Out cross-validator
@@ -120,7 +121,7 @@ def getCrossVal(cv, rs, n, p):
     psplit = PredefinedSplit(test_fold=[ 0,  1, -1,  1])                                  ### Predefined split cross-validator
     tssplit = TimeSeriesSplit(n_splits=n)
     
-    splitClass = {'kfold': kfold, 'gkfold': gkfold, 'stkfold': stkfold, 'logo': logo,
+    splitClass = {'kfold': kfold, 'rkfold': rkfold, 'gkfold': gkfold, 'stkfold': stkfold, 'logo': logo,
                   'lpgo': lpgo, 'loo': loo, 'lpo': lpo, 'shufsplit': shufsplit,
                   'gshufplit': gshufplit, 'stshufsplit': stshufsplit,
                   'psplit': psplit, 'tssplit': tssplit}
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+##    Description    eTOXlab model file format
+##
+##    Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+##
+##    Copyright 2013 Manuel Pastor
+##
+##    This file is part of eTOXlab.
+##
+##    eTOXlab is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation version 3.
+##
+##    eTOXlab is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with eTOXlab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import zipfile
+import numpy as np
+
+from utils import removefile
+
+FORMAT_VERSION = 1        # version of the layout of the arrays, increased when it changes
+MMAP_MIN = 1048576        # arrays larger than this (in bytes) are memory-mapped instead of read
+
+def isModelFile (filename):
+    """Returns True if filename is a model file written by saveModelFile and False if it is a file written
+       by older versions, containing a sequence of numpy .npy records
+    """
+    return zipfile.is_zipfile (filename)
+
+def saveModelFile (filename, kind, arrays):
+    """Saves the dictionary "arrays" to filename as an uncompressed numpy .npz archive, together with the
+       kind of model and the format version
+
+       The arrays are stored without compression, so they can be memory-mapped and read selectively. The
+       file is replaced only when complete, since its former content could be memory-mapped by other processes
+    """
+    arrays = dict(arrays)
+    arrays['__kind__'] = kind
+    arrays['__version__'] = FORMAT_VERSION
+
+    # a file object is used to keep filename unchanged (np.savez would append .npz)
+    try:
+        f = open (filename+'.tmp','wb')
+        np.savez (f, **arrays)
+        f.close()
+        os.rename (filename+'.tmp', filename)
+    except:
+        removefile (filename+'.tmp')
+        raise
+
+def loadModelFile (filename, kind, names=None):
+    """Loads the arrays listed in "names" (all by default) from a model file written by saveModelFile,
+       checking that it contains a model of this kind and a supported format
+
+       Large numeric arrays are memory-mapped (read-only), so only the parts actually used are read
+
+       Returns a dictionary with the arrays
+    """
+    npz = np.load (filename)
+    zf = zipfile.ZipFile (filename)
+
+    try:
+        if str(npz['__kind__']) != kind:
+            raise IOError ('%s does not contain a %s model' % (filename, kind))
+
+        if int(npz['__version__']) > FORMAT_VERSION:
+            raise IOError ('%s was written by a newer version of eTOXlab' % filename)
+
+        if names is None:
+            names = [x[:-4] for x in zf.namelist() if not x.startswith('__')]
+
+        arrays = dict()
+        for name in names:
+            a = mapMember (filename, zf, name+'.npy')
+            if a is None:
+                a = npz[name]
+            arrays[name] = a
+    finally:
+        zf.close()
+        npz.close()
+
+    return arrays
+
+def mapMember (filename, zf, member):
+    """Returns a read-only memory map of the array stored in member of the open archive zf or None if it is
+       compressed, small or cannot be mapped (e.g. arrays of objects)
+    """
+    try:
+        info = zf.getinfo (member)
+        if info.compress_type != zipfile.ZIP_STORED or info.file_size < MMAP_MIN:
+            return None
+
+        f = open (filename,'rb')
+        try:
+            # skip the local header of the member, which can contain extra fields
+            f.seek (info.header_offset)
+            header = f.read (30)
+            nameLen, extraLen = struct.unpack ('<HH', header[26:30])
+            f.seek (info.header_offset+30+nameLen+extraLen)
+
+            version = np.lib.format.read_magic (f)
+            if version == (1,0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0 (f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0 (f)
+            offset = f.tell()
+        finally:
+            f.close()
+    except:
+        return None
+
+    if dtype.hasobject or not shape:
+        return None
+
+    order = 'C'
+    if fortran: order = 'F'
+
+    return np.memmap (filename, dtype=dtype, mode='r', shape=shape, order=order, offset=offset)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+##    Description    eTOXlab molecule record
+##
+##    Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+##
+##    Copyright 2013 Manuel Pastor
+##
+##    This file is part of eTOXlab.
+##
+##    eTOXlab is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation version 3.
+##
+##    eTOXlab is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with eTOXlab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import hashlib
+
+from rdkit import Chem
+from utils import removefile
+
+class molecule:
+    """A single record of a SDFile, processed by the normalization, extraction and prediction workflows
+
+       The record is kept in memory and parsed by RDKit only once. A file is written only when it is
+       required (e.g. by an external program), using the name of the molecule as file name
+    """
+
+    def __init__ (self, name, block=None):
+        """name  : name of the file where the record is stored or will be written
+           block : text of the record in SDFile format. When None, it is read on demand from file "name"
+        """
+        self.name = name
+        self.block = block
+        self.mol = None
+        self.parsed = False
+        self.onDisk = block is None
+
+    def __getstate__ (self):
+        """The RDKit molecule is not pickled (e.g. when the molecule is sent to another process), since it
+           would lose the SDFile fields. It is parsed again if needed
+        """
+        state = self.__dict__.copy()
+        state['mol'] = None
+        state['parsed'] = False
+
+        return state
+
+    def getBlock (self):
+        """Returns the text of the record in SDFile format
+        """
+        if self.block is None:
+            f = open (self.name,'r')
+            self.block = f.read()
+            f.close()
+
+        return self.block
+
+    def getMolBlock (self):
+        """Returns the record without the SDFile fields: the header lines and the connection table,
+           until 'M  END'
+        """
+        lines = self.getBlock().splitlines(True)
+
+        molBlock = []
+        for line in lines:
+            molBlock.append(line)
+            if line.startswith('M  END'):
+                break
+
+        return ''.join(molBlock)
+
+    def getFields (self):
+        """Returns the text of the record after the connection table, containing the SDFile fields
+        """
+        return self.getBlock()[len(self.getMolBlock()):]
+
+    def getStructure (self):
+        """Returns the connection table of the record (from the counts line to 'M  END'), without the
+           header lines, which contain the name, the program and the date, or the SDFile fields
+        """
+        return ''.join(self.getMolBlock().splitlines(True)[3:])
+
+    def getDigest (self):
+        """Returns a digest of the record, which changes when its first line (the name), the connection
+           table or the SDFile fields change, but not with the program and date of the header lines
+        """
+        first = ''.join(self.getBlock().splitlines(True)[:1])
+
+        return hashlib.md5 (first+self.getStructure()+self.getFields()).hexdigest()
+
+    def getMol (self):
+        """Returns the RDKit molecule for this record or None if it cannot be parsed
+
+           The record is parsed only the first time, and the same object is returned in successive calls
+        """
+        if not self.parsed:
+            suppl = Chem.SDMolSupplier()
+            suppl.SetData(self.getBlock())
+            try:
+                self.mol = suppl.next()
+            except StopIteration:
+                self.mol = None
+            self.parsed = True
+
+        return self.mol
+
+    def getFile (self):
+        """Returns the name of a file containing the record, writing it first if it was never stored
+        """
+        if not self.onDisk:
+            self.saveAs (self.name)
+            self.onDisk = True
+
+        return self.name
+
+    def saveAs (self, fileName):
+        """Writes the record to file fileName
+        """
+        if self.block is None:
+            shutil.copy (self.name, fileName)
+            return
+
+        f = open (fileName,'w')
+        f.write (self.block)
+        f.close()
+
+    def derivedName (self, prefix):
+        """Returns the name for a file derived from this molecule, in the same directory
+        """
+        dirName, fileName = os.path.split (self.name)
+
+        return os.path.join (dirName, prefix+fileName)
+
+    def clean (self):
+        """Removes the file containing the record, if any. Records not read yet into memory are lost
+        """
+        if self.onDisk:
+            removefile (self.name)
+            self.onDisk = self.block is None
+
+
+def asMolecule (mol):
+    """Returns "mol" as a molecule object. Strings are considered the name of a file containing the record
+    """
+    if isinstance (mol, molecule):
+        return mol
+
+    return molecule (mol)
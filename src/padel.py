@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+##    Description    eTOXlab client of the PaDEL-Descriptor web service
+##
+##    Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+##
+##    Copyright 2013 Manuel Pastor
+##
+##    This file is part of eTOXlab.
+##
+##    eTOXlab is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation version 3.
+##
+##    eTOXlab is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with eTOXlab.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import socket
+import httplib
+import urlparse
+import threading
+
+class padel:
+    """Client of the PaDEL-Descriptor web service, which can be run as a pool of several server processes
+
+       The connection to every server is kept open and reused for successive requests. The requests are
+       distributed among the servers in turn and, when several requests are sent together, those
+       assigned to different servers are processed simultaneously
+    """
+
+    def __init__ (self, urls):
+        """urls : URL of the web service, to which the parameters are appended, or list of URLs of several
+                  servers
+        """
+        if isinstance (urls, basestring):
+            urls = [urls]
+
+        self.urls = list(urls)
+        self.pid = os.getpid()
+        self.connections = [None]*len(self.urls)
+
+        # processes sharing the pool start using different servers
+        self.next = self.pid % len(self.urls)
+
+    def getConnection (self, k):
+        """Returns the open connection to server k, opening it if needed
+        """
+        if self.connections[k] is None:
+            url = urlparse.urlsplit (self.urls[k])
+            self.connections[k] = httplib.HTTPConnection (url.netloc)
+
+        return self.connections[k]
+
+    def closeConnection (self, k):
+        if self.connections[k] is not None:
+            self.connections[k].close()
+            self.connections[k] = None
+
+    def send (self, k, params, timeout=None):
+        """Sends a request with the list of PaDEL arguments "params" to server k, waiting for the answer
+           "timeout" seconds at most (forever if None)
+
+           Returns a tuple with
+           1) True or False, indicating the success of the request
+           2) The answer of the server (if True) or an error message (if False)
+        """
+        url = urlparse.urlsplit (self.urls[k])
+
+        path = url.path
+        if url.query:
+            path += '?'+url.query
+        path += '|'.join(params)
+
+        # a connection kept open can be closed by the server at any moment, so the request is repeated
+        # once using a new connection
+        for attempt in range(2):
+            try:
+                conn = self.getConnection (k)
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout (timeout)
+                conn.request ('GET', path)
+                resp = conn.getresponse ()
+                page = resp.read ()
+            except socket.timeout:
+                self.closeConnection (k)
+                return (False, 'PaDEL execution timeout')
+            except (httplib.HTTPException, socket.error):
+                self.closeConnection (k)
+                if attempt == 0:
+                    continue
+                return (False, 'PaDEL execution URLError')
+
+            if resp.will_close:
+                self.closeConnection (k)
+
+            if resp.status != 200:
+                return (False, 'PaDEL execution HTTPError')
+
+            return (True, page)
+
+    def compute (self, params, timeout=None):
+        """Sends a request with the list of PaDEL arguments "params" to the next server of the pool
+
+           Returns a tuple like send
+        """
+        k = self.next
+        self.next = (k+1) % len(self.urls)
+
+        return self.send (k, params, timeout)
+
+    def computeMany (self, paramsList, timeout=None):
+        """Sends a request for every list of PaDEL arguments in "paramsList", distributed among the
+           servers of the pool. Every server processes its requests in a separate thread
+
+           Returns a list with a tuple like send for every request, in the same order
+        """
+        n = len(self.urls)
+        first = self.next
+        self.next = (first+len(paramsList)) % n
+
+        results = [None]*len(paramsList)
+
+        def serve (k):
+            for j in range(len(paramsList)):
+                if (first+j) % n == k:
+                    results[j] = self.send (k, paramsList[j], timeout)
+
+        servers = sorted(set([(first+j) % n for j in range(len(paramsList))]))
+
+        if len(servers) < 2:
+            for k in servers:
+                serve (k)
+            return results
+
+        threads = [threading.Thread (target=serve, args=(k,)) for k in servers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        return results
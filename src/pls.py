@@ -28,10 +28,21 @@ from scipy import stats
 from scipy.stats import t
 
 import sys
+import multiprocessing
 from scale import center, scale
 from qualit import *
 from utils import updateProgress
 from design import generateDesignFFD
+from modelfile import isModelFile, saveModelFile, loadModelFile
+
+workerPLS = None   # model used by the worker processes of the cross-validation, inherited from the parent process
+
+def runFold (args):
+    """Runs in a worker process the method of the PLS model with name args[0], using the arguments in args[1]
+    """
+    method, margs = args
+    return getattr(workerPLS, method)(*margs)
+
 class pls:
 
     def __init__ (self):
@@ -77,58 +88,83 @@ class pls:
         self.SDEP = []    # SD error of the predictions
         self.Q2   = []    # cross-validated R2
 
+        self.B  = None   # compiled model: regression coefficients for growing number of LV
+        self.b0 = None   #                 intercepts of B
+        self.R  = None   #                 projection matrix of the scores
+        self.r0 = None   #                 intercepts of R
+        self.G  = None   #                 products of the loadings, for computing the DModX
+
+        self.looData = None   # centered X and its kernel or SSX, shared by all the LOO reduced models
+        self.ffdData = None   # centered X, its SSX and the FFD design, shared by all the FFD reduced models
+
     def saveModel(self,filename):
-        """Saves the whole model to a binary file in numpy .npy format
+        """Saves the whole model to a binary file in numpy .npz format (see modelfile)
 
+           The vectors of every LV are stored as rows of a single matrix
         """
 
-        f = file(filename,'wb')
+        saveModelFile (filename, 'pls', {
+            'Am': self.Am, 'Av': self.Av, 'nobj': self.nobj, 'nvarx': self.nvarx,
+            'mux': self.mux, 'muy': self.muy, 'wgx': self.wgx, 'autoscale': self.autoscale,
+            'W': np.reshape(np.array(self.w, dtype=np.float64), (self.Am, self.nvarx)),
+            'P': np.reshape(np.array(self.p, dtype=np.float64), (self.Am, self.nvarx)),
+            'c': np.array(self.c, dtype=np.float64),
+            'cutoff': np.array(self.cutoff, dtype=np.float64),
+            'T': np.reshape(np.array(self.t, dtype=np.float64), (self.Am, self.nobj)),
+            'dmodx': np.reshape(np.array(self.dmodx, dtype=np.float64), (self.Am, self.nobj)),
+            'SSXex': self.SSXex, 'SSXac': self.SSXac, 'SSYex': self.SSYex, 'SSYac': self.SSYac,
+            'SDEC': self.SDEC,
+            'TP': self.TP, 'TN': self.TN, 'FP': self.FP, 'FN': self.FN,
+            'TPpred': self.TPpred, 'TNpred': self.TNpred, 'FPpred': self.FPpred, 'FNpred': self.FNpred,
+            'SSY': self.SSY[:self.Av], 'SDEP': self.SDEP[:self.Av], 'Q2': self.Q2[:self.Av] })
+
+    def loadModel(self,filename,full=True):
+        """Loads the model from a binary file written by saveModel. When full is False, only the
+           arrays used for projecting new objects, classifying them and estimating their confidence
+           interval are loaded
+
+           Files written by older versions, containing a sequence of numpy .npy records, are also supported
+        """
 
-        np.save(f,self.Am)
-        np.save(f,self.Av)
-        np.save(f,self.nobj)
-        np.save(f,self.nvarx)
-        
-        np.save(f,self.mux)
-        np.save(f,self.muy)
-        np.save(f,self.wgx)
+        if not isModelFile (filename):
+            self.loadModelLegacy (filename)
+            return
 
-        np.save(f,self.autoscale)
-        
-        for a in range(self.Am):
-            np.save(f,self.t[a])
-            np.save(f,self.p[a])
-            np.save(f,self.w[a])
-            np.save(f,self.c[a])
-            np.save(f,self.SSXex[a])
-            np.save(f,self.SSXac[a])
-            np.save(f,self.SSYex[a])
-            np.save(f,self.SSYac[a])
-            np.save(f,self.SDEC[a])
-            np.save(f,self.dmodx[a])
-            
-            np.save(f,self.cutoff[a])
+        names = None
+        if not full:
+            names = ['Am', 'Av', 'nobj', 'nvarx', 'mux', 'muy', 'wgx', 'autoscale', 'W', 'P', 'c', 'cutoff', 'SDEP']
 
-            np.save(f,self.TP[a])
-            np.save(f,self.TN[a])
-            np.save(f,self.FP[a])
-            np.save(f,self.FN[a])
+        m = loadModelFile (filename, 'pls', names)
 
-            np.save(f,self.TPpred[a])
-            np.save(f,self.TNpred[a])
-            np.save(f,self.FPpred[a])
-            np.save(f,self.FNpred[a])
+        self.Am = int(m['Am'])
+        self.Av = int(m['Av'])
+        self.nobj = int(m['nobj'])
+        self.nvarx = int(m['nvarx'])
 
-        for a in range(self.Av):
-            np.save(f,self.SSY[a])
-            np.save(f,self.SDEP[a])
-            np.save(f,self.Q2[a])
-        
-        f.close()
+        self.mux = m['mux']
+        self.muy = float(m['muy'])
+        self.wgx = m['wgx']
 
-            
-    def loadModel(self,filename):
-        """Loads the whole model from a binary file in numpy .npy format
+        self.autoscale = bool(m['autoscale'])
+
+        self.w = list(m['W'])
+        self.p = list(m['P'])
+        self.c = list(m['c'])
+        self.cutoff = list(m['cutoff'])
+        self.SDEP = list(m['SDEP'])
+
+        if not full:
+            return
+
+        self.t = list(m['T'])
+        self.dmodx = list(m['dmodx'])
+
+        for key in ['SSXex', 'SSXac', 'SSYex', 'SSYac', 'SDEC', 'TP', 'TN', 'FP', 'FN',
+                    'TPpred', 'TNpred', 'FPpred', 'FNpred', 'SSY', 'Q2']:
+            setattr(self, key, list(m[key]))
+
+    def loadModelLegacy(self,filename):
+        """Loads the whole model from a binary file in numpy .npy format, written by older versions
 
         """
 
@@ -185,41 +221,24 @@ class pls:
         self.autoscale = bool (f.readline())
 
         t = np.loadtxt (f)
-        c = 0
 
-        self.muy = t[c]
-        c += 1
+        nvarx = self.nvarx
+        self.muy = t[0]
+        self.mux = t[1:1+nvarx].copy()
+        self.wgx = t[1+nvarx:1+2*nvarx].copy()
 
-        self.mux = np.zeros(self.nvarx,dtype=np.float64)
-        for i in range (self.nvarx):
-            self.mux[i] = t[c]
-            c += 1
+        # p and w of every LV follow, and then the c and cutoff values
+        c = 1+2*nvarx
+        PW = np.reshape(t[c:c+2*self.Am*nvarx], (self.Am, 2, nvarx))
+        c += 2*self.Am*nvarx
 
-        self.wgx = np.zeros(self.nvarx,dtype=np.float64)
-        for i in range (self.nvarx):
-            self.wgx[i] = t[c]
-            c += 1
+        self.p = [PW[a,0].copy() for a in range (self.Am)]
+        self.w = [PW[a,1].copy() for a in range (self.Am)]
 
-        for a in range (self.Am):
-            p = np.zeros(self.nvarx,dtype=np.float64)
-            for i in range (self.nvarx):
-                p[i] = t[c]
-                c += 1
-            self.p.append(p)
-                
-            w = np.zeros(self.nvarx,dtype=np.float64)
-            for i in range (self.nvarx):
-                w[i] = t[c]
-                c += 1
-            self.w.append(w)
+        self.c = list(t[c:c+self.Am])
+        c += self.Am
 
-        for a in range(self.Am):
-            self.c.append(t[c])
-            c += 1
-
-        for a in range(self.Am): 
-            self.cutoff.append(t[c])
-            c += 1            
+        self.cutoff = list(t[c:c+self.Am])
 
         f.close()
 
@@ -355,7 +374,7 @@ class pls:
 
             dof = nvarx-a
             if dof <= 0 : dof = 1
-            dmodx = [np.sqrt(d/dof) for d in dmodx] 
+            dmodx = np.sqrt(dmodx/dof)
 
             SSXold=SSXnew
             SSYold=SSYnew
@@ -394,9 +413,16 @@ class pls:
         self.FPpred = np.zeros(self.Am)
         self.FNpred = np.zeros(self.Am)
 
-    def validateLOO (self, A, gui=False):
+    def validateLOO (self, A, gui=False, numWorkers=1):
         """ Validates A dimensions of an already built PLS model, using Leave-One-Out cross-validation
 
+            The objects are predicted serially or, if numWorkers is larger than one, by a pool of processes
+
+            The reduced models are never built from copies of X. When X is not autoscaled and has less
+            objects than variables, they are built on the kernel matrix XX' (getLOOKernel). Otherwise the
+            centering and scaling of every reduced matrix are downdated from those of the whole matrix and
+            the products with the reduced matrix are obtained from the whole matrix (getLOOImplicit)
+
             Returns nothing. The results of the cv (SSY, SDEP and Q2) are stored internally
         """
 
@@ -415,27 +441,17 @@ class pls:
         SSY = np.zeros(A,dtype=np.float64)
         YP = np.zeros ((nobj,A+1),dtype=np.float64)
 
-        if gui: updateProgress (0.0)
-        
-        for i in range (nobj):
-            
-            # build reduced X and Y matrices removing i object
-            Xr = np.delete(X,i,axis=0)
-            Yr = np.delete(Y,i)
+        # X is centered only once, and the reduced matrices are obtained from it
+        Xc, muxc = center(X)
 
-            Xr,muxr = center(Xr)
-            Xr,wgxr = scale (Xr, self.autoscale)
-           
-            Yr,muyr = center(Yr)
+        if not self.autoscale and nobj < nvarx:
+            self.looData = (Xc, np.dot(Xc,Xc.T), None)
+        else:
+            self.looData = (Xc, None, np.einsum('ij,ij->j',Xc,Xc))  # SSX of every variable
 
-            xp = np.copy(X[i,:])
-            
-            xp -= muxr
-            xp *= wgxr
-            
-            # predicts y for the i object, using A LV
-            yp = self.getLOO(Xr,Yr,xp,A)      
-            yp += muyr
+        argList = [(i, A) for i in range (nobj)]
+        
+        for i, yp in self.runFolds ('predictLOO', argList, numWorkers, gui):
 
             # updates SSY with the object i errors
             YP[i,0]=Y[i]
@@ -444,9 +460,7 @@ class pls:
                 SSY[a]+= np.square(yp[a]-Y[i])
                 YP[i,a+1]=yp[a]
 
-            if gui : updateProgress (float(i)/float(nobj))
-
-        if gui : print
+        self.looData = None
         
         self.SSY  = SSY        
         self.SDEP = [np.sqrt(i/nobj) for i in SSY]
@@ -456,6 +470,125 @@ class pls:
 
         return (YP)
 
+    def validateCV (self, A, cv, gui=False, numWorkers=1):
+        """ Validates A dimensions of an already built PLS model, using the cross-validation defined by the
+            sklearn splitter cv (e.g. k-fold or repeated k-fold). A reduced model is built for every split,
+            serially or, if numWorkers is larger than one, by a pool of processes
+
+            The SDEP and Q2 are computed from all the predictions. Objects predicted several times (e.g. in
+            repeated k-fold) are reported with their mean prediction, and those never predicted with NaN
+
+            Returns the experimental and predicted Y values. The results of the cv (SSY, SDEP and Q2) are
+            stored internally
+        """
+
+        if self.X == None or self.Y == None:
+            return
+
+        X = self.X
+        Y = self.Y
+
+        nobj,nvarx = np.shape (X)
+
+        SSY0 = 0.0
+        SSY = np.zeros(A,dtype=np.float64)
+        YP = np.zeros ((nobj,A+1),dtype=np.float64)
+        npred = np.zeros(nobj,dtype=np.float64)
+
+        Ym = np.mean(Y)
+
+        argList = [(train, test, A) for train, test in cv.split(X,Y)]
+
+        for test, yp in self.runFolds ('predictFold', argList, numWorkers, gui):
+
+            # updates SSY with the errors of the test objects
+            SSY0 += np.sum(np.square(Y[test]-Ym))
+            SSY += np.sum(np.square(yp-Y[test][:,np.newaxis]),axis=0)
+
+            YP[test,1:] += yp
+            npred[test] += 1
+
+        YP[:,0] = Y
+        YP[npred==0,1:] = np.nan
+        YP[npred>0,1:] /= npred[npred>0][:,np.newaxis]
+
+        ntot = np.sum(npred)
+
+        self.SSY  = SSY
+        self.SDEP = [np.sqrt(i/ntot) for i in SSY]
+        self.Q2   = [1.00-(i/SSY0) for i in SSY]
+
+        self.Av = A
+
+        return (YP)
+
+    def runFolds (self, method, argList, numWorkers=1, gui=False):
+        """ Runs the method with name "method" for every tuple of arguments in argList, serially or, if
+            numWorkers is larger than one, by a pool of processes which inherit this model
+
+            Yields the results in the order of argList
+        """
+        global workerPLS
+
+        n = len(argList)
+
+        if gui: updateProgress (0.0)
+
+        pool = None
+        if numWorkers < 2 or n < 2:
+            results = (getattr(self,method)(*args) for args in argList)
+        else:
+            workerPLS = self
+            pool = multiprocessing.Pool (numWorkers)
+            chunk = max(1, n/(4*numWorkers))
+            results = pool.imap (runFold, [(method, args) for args in argList], chunk)
+
+        try:
+            for k, result in enumerate(results):
+                yield result
+
+                if gui : updateProgress (float(k)/float(n))
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+                workerPLS = None
+
+        if gui : print
+
+    def predictLOO (self, i, A):
+        """ Predicts object i with a model of A dimensions built without it, using the data in looData
+
+            Returns a tuple with i and the predicted y values using growing number of LV
+        """
+        Xc, K, SS = self.looData
+
+        # build reduced Y vector removing i object
+        Yr = np.delete(self.Y,i)
+        Yr,muyr = center(Yr)
+
+        # predicts y for the i object, using A LV
+        if K is not None:
+            yp = self.getLOOKernel(K,Yr,i,A)
+        else:
+            yp = self.getLOOImplicit(Xc,SS,Yr,i,A)
+        yp += muyr
+
+        return (i, yp)
+
+    def predictFold (self, train, test, A):
+        """ Predicts the objects with index in test with a model of A dimensions built with the objects with
+            index in train
+
+            Returns a tuple with test and a matrix with the predicted y values using growing number of LV
+        """
+        fold = pls ()
+        fold.build (self.X[train], self.Y[train], targetA=A, autoscale=self.autoscale)
+
+        success, result = fold.projectBatch (self.X[test], A)
+
+        return (test, result[0])
+
 
     def project (self, x, A):
         """projects query object x into current model using A LV
@@ -468,6 +601,10 @@ class pls:
 
         if A > self.Am:
             return (False, 'Too many LV')
+
+        if self.B is not None:
+            success, (Y, T, D) = self.projectCompiled (x, A)
+            return (True, (Y[0], T[0], D[0]))
                 
         x-=self.mux
         x*=self.wgx
@@ -490,6 +627,149 @@ class pls:
 
         return (True, (y, t, d))
 
+    def projectBatch (self, X, A):
+        """projects all the query objects in matrix X (nobj x nvarx) into current model using A LV
+
+           The matrix provided as argument is not modified
+
+           Returns
+           Y:    matrix (nobj x A) of predicted Y values using growing number of LV
+           T:    matrix (nobj x A) of scores
+           D:    matrix (nobj x A) with the DModX for every dimension
+        """
+
+        if A > self.Am:
+            return (False, 'Too many LV')
+
+        if self.B is not None:
+            return self.projectCompiled (X, A)
+
+        X = np.array(X, dtype=np.float64, ndmin=2)
+
+        X = X-self.mux
+        X *= self.wgx
+
+        nobj = np.shape(X)[0]
+
+        Y=np.zeros((nobj,A),dtype=np.float64)
+        T=np.zeros((nobj,A),dtype=np.float64)
+        D=np.zeros((nobj,A),dtype=np.float64)
+
+        yp = np.zeros(nobj,dtype=np.float64)
+        for a in range (A):
+            t = np.dot(X,self.w[a])
+            yp += t*self.c[a]
+            T[:,a] = t
+            Y[:,a] = yp
+            X -= np.outer(t,self.p[a])
+            dof = (self.nvarx-a)
+            if dof <= 0 : dof = 1
+            D[:,a] = np.sqrt(np.sum(X*X,axis=1)/dof)
+
+        Y+=self.muy
+
+        return (True, (Y, T, D))
+
+    def compile (self):
+        """Computes the compiled form of the model, used by project and projectBatch from then on
+
+           The scores are obtained by a single projection matrix R = W(P'W)^-1 and the predicted values by
+           the regression coefficients B = W(P'W)^-1 c for growing number of LV, both with the centering and
+           scaling of X folded in. The DModX are computed from the scores and the products of the loadings
+        """
+
+        W = np.reshape(np.array(self.w, dtype=np.float64), (self.Am, self.nvarx))
+        P = np.reshape(np.array(self.p, dtype=np.float64), (self.Am, self.nvarx))
+        c = np.array(self.c, dtype=np.float64)
+
+        # rows of R, applied to the original (not centered or scaled) X
+        R = np.linalg.solve (np.dot(P,W.T).T, W)
+        R *= self.wgx
+
+        self.R  = R
+        self.r0 = -np.dot(R,self.mux)
+        self.B  = np.cumsum(R*c[:,np.newaxis], axis=0)
+        self.b0 = self.muy + np.cumsum(self.r0*c)
+        self.G  = np.dot(P,P.T)
+
+        self.p = list(P)
+
+    def projectCompiled (self, X, A):
+        """projects all the query objects in matrix X (nobj x nvarx) into the compiled model (see compile)
+           using A LV
+
+           Returns the same results as projectBatch
+        """
+
+        if A > self.Am:
+            return (False, 'Too many LV')
+
+        X = np.array(X, dtype=np.float64, ndmin=2)
+
+        Y = np.dot(X,self.B[:A].T) + self.b0[:A]
+        T = np.dot(X,self.R[:A].T) + self.r0[:A]
+
+        # squared norm of the residuals, after removing the growing number of LV
+        Xs = (X-self.mux)*self.wgx
+        P  = np.array(self.p[:A], ndmin=2)
+
+        SSX = np.einsum('ij,ij->i',Xs,Xs)
+        XP = np.dot(Xs,P.T)
+
+        D = np.zeros(np.shape(T),dtype=np.float64)
+        for a in range (A):
+            SSX -= 2.0*T[:,a]*XP[:,a] - T[:,a]*T[:,a]*self.G[a,a]
+            SSX += 2.0*T[:,a]*np.dot(T[:,:a],self.G[:a,a])
+            dof = (self.nvarx-a)
+            if dof <= 0 : dof = 1
+            D[:,a] = np.sqrt(np.maximum(SSX,0.0)/dof)
+
+        return (True, (Y, T, D))
+
+    def saveCompiled (self, filename):
+        """Saves the compiled model (see compile) to a binary file in numpy .npz format (see modelfile),
+           with the information required for predicting new objects
+
+        """
+
+        if self.B is None:
+            self.compile()
+
+        saveModelFile (filename, 'plsc', {
+            'Am': self.Am, 'Av': self.Av, 'nvarx': self.nvarx, 'autoscale': self.autoscale,
+            'mux': self.mux, 'muy': self.muy, 'wgx': self.wgx,
+            'B': self.B, 'b0': self.b0, 'R': self.R, 'r0': self.r0, 'G': self.G,
+            'P': np.array(self.p, dtype=np.float64),
+            'c': np.array(self.c, dtype=np.float64),
+            'cutoff': np.array(self.cutoff, dtype=np.float64),
+            'SDEP': self.SDEP[:self.Av] })
+
+    def loadCompiled (self, filename):
+        """Loads the compiled model from a binary file written by saveCompiled
+
+        """
+
+        m = loadModelFile (filename, 'plsc')
+
+        self.Am = int(m['Am'])
+        self.Av = int(m['Av'])
+        self.nvarx = int(m['nvarx'])
+        self.autoscale = bool(m['autoscale'])
+
+        self.mux = m['mux']
+        self.muy = float(m['muy'])
+        self.wgx = m['wgx']
+
+        self.B  = m['B']
+        self.b0 = m['b0']
+        self.R  = m['R']
+        self.r0 = m['r0']
+        self.G  = m['G']
+
+        self.p = list(m['P'])
+        self.c = list(m['c'])
+        self.cutoff = list(m['cutoff'])
+        self.SDEP = list(m['SDEP'])
         
     def extractLV (self, X, Y):
         """Extracts a single LV from the provided X and Y matrices using NIPALS algorithm
@@ -503,29 +783,22 @@ class pls:
            c:    inner relationship
         """
         
-        nobj,nvarx = np.shape (X)
-        w = np.zeros(nvarx, dtype=np.float64)
-        p = np.zeros(nvarx, dtype=np.float64)
-        t = np.zeros(nobj , dtype=np.float64)
-
-        uu = np.dot(Y.T,Y)
-        for j in range(nvarx):
-            w[j] = np.dot(Y,X[:,j])/uu
+        # all the products are computed on whole matrices (X'y, Xw and X't)
+        uu = np.dot(Y,Y)
+        w = np.dot(Y,X)/uu
             
         ww = np.sqrt(np.dot(w,w))
         if ww>1e-9 : w/=ww
 
-        for i in range(nobj):
-            t[i] = np.dot(w,X[i,:])
+        t = np.dot(X,w)
 
         tt = np.dot(t,t)
 
         if (tt>1e-9):
-            for j in range(nvarx):
-                p[j] = np.dot(t,X[:,j])/tt
-
+            p = np.dot(t,X)/tt
             c = np.dot(t,Y)/tt
         else:
+            p = np.zeros(np.shape(X)[1], dtype=np.float64)
             c = 0.00
 
         return t, p, w, c
@@ -540,16 +813,10 @@ class pls:
            d:      vector with the SSX for every object 
         """
         
-        nobj,nvarx = np.shape (X)
-        
-        SSX=SSY=0.0
+        d = np.einsum('ij,ij->i',X,X)   # squared norm of every row, without copying X
 
-        d = np.zeros(nobj,dtype=np.float64)
-        
-        for i in range (nobj):
-            d[i] = np.dot(X[i,:],X[i,:])
-            SSX += d[i]
-            SSY += np.square(Y[i])
+        SSX = np.sum(d)
+        SSY = np.dot(Y,Y)
             
         return SSX, SSY, d
 
@@ -557,14 +824,11 @@ class pls:
     def deflateLV (self, X, Y, t, p, c):
         """Deflates both the X and Y matrices, using the provided t, p and c vectors
 
-           Returns deflated X and Y
+           The matrices are updated in place. Returns deflated X and Y
         """
         
-        nobj,nvarx = np.shape (X)
-        
-        for i in range (nobj):
-            X[i,:] -= (t[i]*p)
-            Y[i] -= t[i]*c
+        X -= np.outer(t,p)
+        Y -= t*c
         
         return X,Y
 
@@ -591,38 +855,170 @@ class pls:
             X, Y = self.deflateLV(X, Y, t, p, c)
         return y
 
+    def getLOOKernel (self, K, Y, i, A):
+        """Builds a model of A dimension without object i, yielding a prediction y for this object. The model
+           is built on the kernel matrix K = XX' of the centered X matrix (nobj x nobj), so every LV is
+           extracted with operations on vectors and matrices of nobj elements, irrespectively of the number
+           of variables. Only valid for models without scaling
+
+           Notice that Y must be the centered Y vector of the reduced model, without object i
+
+           Returns the predicted y value for the object i using growing number of LV
+        """
+
+        n = np.shape(K)[0]
+        r = np.arange(n) != i
+
+        # kernel of the reduced matrix, centered with its own mean, and products of the reduced matrix with
+        # the query object, centered in the same way
+        Kr = K[r][:,r]
+        mr = np.mean(Kr,axis=1)
+        Kr -= mr[:,np.newaxis]
+        Kr -= mr
+        Kr += np.mean(mr)
+
+        kq = K[r,i]-mr
+        kq -= np.mean(kq)
+
+        y = np.zeros(A,dtype=np.float64)
+        yp = 0.0
+
+        for a in range(A):
+            # w = X'Y/uu normalized, t = Xw and the score of the query object are obtained from K
+            uu = np.dot(Y,Y)
+            KY = np.dot(Kr,Y)
+            ww = np.sqrt(max(np.dot(Y,KY),0.0))/uu
+            wn = uu*ww if ww>1e-9 else uu
+
+            t  = KY/wn
+            tq = np.dot(kq,Y)/wn
+
+            tt = np.dot(t,t)
+            if (tt>1e-9):
+                c = np.dot(t,Y)/tt
+
+                # deflation of X (X-tp', with p=X't/tt) and of the query object, applied to the kernel
+                Kt = np.dot(Kr,t)
+                kq -= Kt*(tq/tt)
+                kq -= t*(np.dot(t,kq)/tt)
+
+                tKt = np.dot(t,Kt)/tt
+                Kr -= np.outer(t,Kt/tt)
+                Kr -= np.outer(Kt/tt,t)
+                Kr += np.outer(t,t*(tKt/tt))
+
+                Y = Y-t*c
+            else:
+                c = 0.00
+
+            yp += tq*c
+            y[a] = yp
+
+        return y
+
+    def getLOOImplicit (self, X, SS, Y, i, A, mask=None):
+        """Builds a model of A dimension without object i, yielding a prediction y for this object. The
+           reduced matrix is never formed: its mean and scaling weights are downdated from those of the
+           centered X matrix and its column sums of squares SS, and its products with vectors, including the
+           deflation of the previous LV, are obtained from X. When a boolean mask is provided, only the
+           variables set to True are used
+
+           Notice that X must be centered and Y must be the centered Y vector of the reduced model
+
+           Returns the predicted y value for the object i using growing number of LV
+        """
+
+        n, nvarx = np.shape(X)
+        r = np.arange(n) != i
+
+        xi = X[i,:]
+        m  = xi/(1.0-n)                     # mean of the reduced matrix
+
+        wg = np.ones(nvarx,dtype=np.float64)
+        if self.autoscale:
+            var = (SS-xi*xi*(n/(n-1.0)))/(n-2.0)
+
+            # variances close to zero are affected by rounding errors, so they are computed from the data
+            low = var < 1.0e-10*SS/(n-1.0)+1.0e-12
+            if np.any(low):
+                var[low] = np.square(np.std(np.delete(X[:,low],i,axis=0),axis=0,ddof=1))
+
+            st = np.sqrt(np.maximum(var,0.0))
+            wg = np.zeros(nvarx,dtype=np.float64)
+            wg[st>=1.0e-7] = 1.0/st[st>=1.0e-7]
+
+        if mask is not None:
+            wg *= mask
+
+        xp = (xi-m)*wg
+
+        u  = np.zeros(n,dtype=np.float64)
+        T  = []
+        P  = []
+
+        def Xdot (v):
+            # product of the reduced, deflated matrix with vector v (nvarx)
+            gv = wg*v
+            xv = np.dot(X,gv)[r]-np.dot(m,gv)
+            for tk, pk in zip(T,P):
+                xv -= tk*np.dot(pk,v)
+            return xv
+
+        def XTdot (v):
+            # product of the transposed reduced, deflated matrix with vector v (nobj-1)
+            u[r] = v
+            xv = wg*(np.dot(u,X)-m*np.sum(v))
+            for tk, pk in zip(T,P):
+                xv -= pk*np.dot(tk,v)
+            return xv
+
+        y = np.zeros(A,dtype=np.float64)
+        yp = 0.0
+
+        for a in range(A):
+            uu = np.dot(Y,Y)
+            w = XTdot(Y)/uu
+
+            ww = np.sqrt(np.dot(w,w))
+            if ww>1e-9 : w/=ww
+
+            t = Xdot(w)
+            tt = np.dot(t,t)
+
+            tq = np.dot(xp,w)
+
+            if (tt>1e-9):
+                p = XTdot(t)/tt
+                c = np.dot(t,Y)/tt
+
+                xp -= p*tq
+                T.append(t)
+                P.append(p)
+                Y = Y-t*c
+            else:
+                c = 0.00
+
+            yp += tq*c
+            y[a] = yp
+
+        return y
+
     def recalculate (self):
         yr = np.zeros ((self.nobj,self.Am+1),dtype=np.float64)
-        for i in range (self.nobj):
-            # self.project could be destructive, since the X vector is deflated, so make sure to copy!
-            success, result = self.project(self.X[i,:].copy(),self.Am) # just for final #LV
-            yr[i,0]=self.Y[i]
-            if success:
-                yr[i,1:] = result[0]        
+        yr[:,0] = self.Y
+        success, result = self.projectBatch(self.X, self.Am) # just for final #LV
+        if success:
+            yr[:,1:] = result[0]
         return yr
 
     def calcConfussion (self, cutoff, ycutoff = 0.5):
 
-        by = []
         yr = self.recalculate()
-        for i in range (self.nobj):
-            by.append (yr[i][0] > ycutoff) # yr[0] is the experimental Y
+        yb = yr[:,0] > ycutoff  # yr[0] is the experimental Y
             
         for a in range (self.Am):
 
-            TP=TN=FP=FN=0
-
-            for i in range(self.nobj):                
-                if by[i]:
-                    if yr[i][a+1] > cutoff:
-                        TP+=1
-                    else:
-                        FN+=1
-                else:
-                    if yr[i][a+1] > cutoff:
-                        FP+=1
-                    else:
-                        TN+=1
+            TP, TN, FP, FN = confusion (yb, yr[:,a+1], cutoff)
 
 ##            sens = sensitivity (TP, FN)
 ##            spec = specificity (TN, FP)
@@ -636,99 +1032,74 @@ class pls:
             self.FP[a] = FP
             self.FN[a] = FN
 
-    def predConfussion (self, ycutoff = 0.5):
+    def predConfussion (self, ycutoff = 0.5, cv=None, numWorkers=1):
+        """ Computes the confusion matrix of the predictions obtained by LOO or, if a sklearn splitter is
+            provided in cv, by this cross-validation (see validateCV)
+        """
 
-        by = []
-        yp = self.validateLOO(self.Am, gui=True)
+        if cv is None:
+            yp = self.validateLOO(self.Am, gui=True, numWorkers=numWorkers)
+        else:
+            yp = self.validateCV(self.Am, cv, gui=True, numWorkers=numWorkers)
 
-        for i in range (self.nobj):
-            by.append (yp[i][0] > ycutoff) # yp[0] is the experimental Y
-            
-        for a in range (self.Am):
+        yp = np.asarray(yp, dtype=np.float64)
+        yb = yp[:,0] > ycutoff  # yp[0] is the experimental Y
 
-            TP=TN=FP=FN=0
+        # objects never predicted in the cross-validation (NaN) are counted as negative
+        with np.errstate(invalid='ignore'):
+            for a in range (self.Am):
 
-            for i in range(self.nobj):                
-                if by[i]:
-                    if yp[i][a+1] > self.cutoff[a]:
-                        TP+=1
-                    else:
-                        FN+=1
-                else:
-                    if yp[i][a+1] > self.cutoff[a]:
-                        FP+=1
-                    else:
-                        TN+=1
+                TP, TN, FP, FN = confusion (yb, yp[:,a+1], self.cutoff[a])
 
-##            sens = sensitivity (TP, FN)
-##            spec = specificity (TN, FP)
+##                sens = sensitivity (TP, FN)
+##                spec = specificity (TN, FP)
 ##
-##            print 'pred sens %f' % sens
-##            print 'pred spec %f' % spec           
+##                print 'pred sens %f' % sens
+##                print 'pred spec %f' % spec           
 
-            self.TPpred[a] = TP
-            self.TNpred[a] = TN
-            self.FPpred[a] = FP
-            self.FNpred[a] = FN
+                self.TPpred[a] = TP
+                self.TNpred[a] = TN
+                self.FPpred[a] = FP
+                self.FNpred[a] = FN
 
-        # return a binary (0 = False, 1 = True) array for being processed in ADAN
-        ypbin = np.zeros (self.nobj,dtype=np.float64)
-        
-        for i in range(self.nobj):
-            if (yp[i][-1] > self.cutoff[-1]) : ypbin[i] = 1.0 
+            # return a binary (0 = False, 1 = True) array for being processed in ADAN
+            ypbin = (yp[:,-1] > self.cutoff[-1]).astype(np.float64)
                 
         return (ypbin)
     
                  
-    def calcOptCutoff (self, ycutoff = 0.5, nsteps = 100):
+    def calcOptCutoff (self, ycutoff = 0.5):
+        """ Assigns to every LV the cutoff for which the sensitivity and specificity of the recalculated
+            values are closest, and the corresponding confusion matrix (see qualit.optimalCutoff)
+        """
 
-        by = []
         yr = self.recalculate()
-        for i in range (self.nobj):
-            by.append (yr[i][0] > ycutoff) # yr[0] is the experimental Y
+        yb = yr[:,0] > ycutoff  # yr[0] is the experimental Y
             
         for a in range (self.Am):
-            bestv  = 1.0e20
-            bestc  = 0.0           
-            cutoff = 0.0
-            bTP=bTN=bFP=bFN=0
-
-            for step in range (nsteps):
-                cutoff+=1.0/nsteps
-                TP=TN=FP=FN=0
-
-                for i in range(self.nobj):                
-                    if by[i]:
-                        if yr[i][a+1] > cutoff:
-                            TP+=1
-                        else:
-                            FN+=1
-                    else:
-                        if yr[i][a+1] > cutoff:
-                            FP+=1
-                        else:
-                            TN+=1
-
-                sens = sensitivity (TP, FN)
-                spec = specificity (TN, FP)
-                
-                if abs(sens-spec) < bestv :
-                    bestv = abs(sens-spec)
-                    bestc = cutoff
-                    bTP = TP
-                    bTN = TN
-                    bFP = FP
-                    bFN = FN
+            cutoff, (TP,TN,FP,FN) = optimalCutoff (yb, yr[:,a+1])
 
-            self.cutoff[a] = bestc
-            self.TP[a] = bTP
-            self.TN[a] = bTN
-            self.FP[a] = bFP
-            self.FN[a] = bFN
-        
-        #return (bestc, (bTP,bTN,bFP,bFN))
+            self.cutoff[a] = cutoff
+            self.TP[a] = TP
+            self.TN[a] = TN
+            self.FP[a] = FP
+            self.FN[a] = FN
+
+    def varSelectionFFD (self, X, Y , A, autoscale=False, gui=True, numWorkers=1, stopBlocks=0):
+        """ Selects the X variables by FFD (GOLPE): a reduced model is validated by LOO for every combination
+            of a fractional factorial design, and the effect of every variable on the SDEP is compared with
+            those of dummy variables
+
+            The reduced models use the columns of a single centered copy of X, masked by the design, and are
+            validated serially or, if numWorkers is larger than one, by a pool of processes which inherit it
 
-    def varSelectionFFD (self, X, Y , A, autoscale=False, gui=True):
+            When stopBlocks is larger than zero, once half of the combinations have been validated the effects
+            are evaluated after every block of 1/16 of them, and the selection stops when the classification
+            of the variables did not change in stopBlocks successive blocks
+
+            Returns a vector with the classification of every variable of X (0 excluded, 1 fixed, 2 uncertain)
+            and the number of excluded variables
+        """
 
         # TODO : set dummyStep and ratio as tunable parameters
         
@@ -749,12 +1120,7 @@ class pls:
 
         #print index
         
-        Xb = np.empty((nobj, nvarxb), dtype=np.float64)
-        k=0
-        for i in range (nvarx):
-            if index[i]>0:
-                Xb[:,k]=X[:,i]
-                k+=1
+        Xb = X[:,index>0]
         
         nobj, nvarx = np.shape (Xb)
         ndummy = int (np.floor(nvarx/dummyStep))              # number of dummy variables
@@ -773,60 +1139,122 @@ class pls:
 
         # initializes effects
         effect  = np.zeros(nvarxm,dtype=np.float64)
-        xdesign = np.zeros(nvarx ,dtype=np.int)
+
+        # x design lines (not considering dummies)
+        xvars = np.arange(nvarxm)%(dummyStep+1) > 0
+        xdesign = np.zeros((ncomb,nvarx),dtype=np.bool)
+        xdesign[:,:np.sum(xvars)] = design[:,xvars]>0
 
         # set common model stuff
         self.autoscale = autoscale
         self.Y = Y.copy()
 
-        if gui: updateProgress (0.0)
-        
-        for i in range(ncomb):
+        Xc, muxc = center(Xb)
+        self.ffdData = (Xc, np.einsum('ij,ij->j',Xc,Xc), xdesign)
 
-            # extract x design line (not considering dummies)            
-            k=0
-            for j in range (nvarxm):
-                if j%(dummyStep+1) :         # non-dummy var
-                    xdesign[k]=design[i][j]
-                    k+=1
-                    
-            nvarxr = int(np.sum(xdesign>0))
+        argList = [(i, A) for i in range (ncomb)]
 
-            # if this design line contains few x vars skip the model validation
-            if nvarxr <= (A+1) : continue
-            
-            # build a X reduced matrix Xr
-            Xr = np.empty((nobj, nvarxr), dtype=np.float64)
-            k=0
-            for j in range (nvarx):
-                if xdesign[j]>0:
-                    Xr[:,k]=Xb[:,j]
-                    k+=1
-
-            # set the reduced matrix as model matrix and validate
-            self.X = Xr.copy()
-            self.validateLOO (A)
-            
-            # accumulate the min SDEP to a effect vector for every variable (including dummies)
-            minSDEP = 2.0e10
-            for a in self.SDEP:
-                if a < minSDEP : minSDEP = a
+        blockSize = max(1,ncomb/16)
+        resOld = None
+        nstable = 0
 
-            if minSDEP > SDEP0x10:
-                minSDEP = SDEP0
+        for i, SDEP in enumerate(self.runFolds ('validateFFD', argList, numWorkers, gui)):
+
+            # if this design line contains few x vars the model validation was skipped
+            if SDEP is not None:
+                # accumulate the min SDEP to a effect vector for every variable (including dummies)
+                minSDEP = np.min(SDEP)
+
+                if minSDEP > SDEP0x10:
+                    minSDEP = SDEP0
             
-            effect += design[i]*minSDEP
+                effect += design[i]*minSDEP
+
+            # optional early stop, when the classification of the variables does not change
+            if stopBlocks>0 and (i+1)%blockSize == 0 and (i+1) >= ncomb/2 and (i+1) < ncomb:
+                res = self.classifyFFD (effect/((i+1)/2), nvarx, ndummy, dummyStep)
+                if resOld is not None and np.array_equal(res,resOld):
+                    nstable += 1
+                    if nstable >= stopBlocks:
+                        break
+                else:
+                    nstable = 0
+                resOld = res
 
-            if gui: updateProgress (float(i)/float(ncomb))
+        self.ffdData = None
 
         # calculate effects
-        effect /= (ncomb/2)
+        if i+1 < ncomb:
+            effect /= ((i+1)/2)
+        else:
+            effect /= (ncomb/2)
+
+        res = self.classifyFFD (effect, nvarx, ndummy, dummyStep)
+
+        #print res
+
+        # map the result in a vector representing the full, original X
+        resExp = np.ones(nvarxOri,dtype=np.int)
+        k = 0
+        for i in range (nvarxOri):
+            if index[i]==0:
+                resExp[i] = 0       # these were already excluded or are inactive variables
+            else :
+                resExp[i] = res[k]
+                k += 1
         
+        return resExp, np.sum(res==0)
+
+    def validateFFD (self, i, A):
+        """ Validates by LOO a model of A dimensions built only with the variables of the line i of the FFD
+            design, using the data in ffdData
+
+            Returns the SDEP for every dimension, or None if the line contains too few variables
+        """
+        Xc, SS, xdesign = self.ffdData
+
+        mask = xdesign[i]
+        nvarxr = int(np.sum(mask))
+
+        if nvarxr <= (A+1) : return None
+
+        nobj = np.shape(Xc)[0]
+
+        K = None
+        if not self.autoscale and nobj < nvarxr:
+            Xm = Xc[:,mask]
+            K = np.dot(Xm,Xm.T)
+
+        SSY = np.zeros(A,dtype=np.float64)
+        for j in range (nobj):
+            Yr = np.delete(self.Y,j)
+            Yr,muyr = center(Yr)
+
+            if K is not None:
+                yp = self.getLOOKernel(K,Yr,j,A)
+            else:
+                yp = self.getLOOImplicit(Xc,SS,Yr,j,A,mask)
+            yp += muyr
+
+            SSY += np.square(yp-self.Y[j])
+
+        return np.sqrt(SSY/nobj)
+
+    def classifyFFD (self, effect, nvarx, ndummy, dummyStep):
+        """ Classifies the X variables comparing their FFD effects with those of the dummy variables
+
+            Returns a vector with the classification of the nvarx variables (0 excluded, 1 fixed, 2 uncertain)
+        """
+
+        effect = effect.copy()
+
         # compute dummy effects
         dummyEffect = 0.00
         dummyMean = 0.00
         k  = 0
 
+        nvarxm = len(effect)
+
         for i in range(nvarxm):
             if not (i%(dummyStep+1)) :   # dummy var
                 dummyMean+=effect[i]
@@ -857,19 +1285,7 @@ class pls:
             elif effect[i] > 0 :
                 res[i] = 0                         # excluded
 
-        #print res
-
-        # map the result in a vector representing the full, original X
-        resExp = np.ones(nvarxOri,dtype=np.int)
-        k = 0
-        for i in range (nvarxOri):
-            if index[i]==0:
-                resExp[i] = 0       # these were already excluded or are inactive variables
-            else :
-                resExp[i] = res[k]
-                k += 1
-        
-        return resExp, np.sum(res==0)
+        return res
 
     def excludeVar (self, X, res):
         X[:,res==0]=0.000   
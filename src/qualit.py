@@ -43,6 +43,72 @@ def MCC (TP, TN, FP, FN):
     else:
         return float(0)
 
+def confusion (yb, yp, cutoff):
+    """ Computes the confusion matrix of the predicted values yp, which are positive when above the cutoff,
+        for objects with experimental class yb (boolean array)
+
+        Returns a tuple with TP, TN, FP and FN
+    """
+    yb = np.asarray(yb, dtype=np.bool)
+    pos = np.asarray(yp) > cutoff
+
+    TP = int(np.sum(pos & yb))
+    FP = int(np.sum(pos & ~yb))
+    FN = int(np.sum(yb))-TP
+    TN = len(yb)-TP-FP-FN
+
+    return (TP, TN, FP, FN)
+
+def optimalCutoff (yb, yp):
+    """ Finds the cutoff of the predicted values yp for which the sensitivity and the specificity obtained
+        for objects with experimental class yb (boolean array) are closest
+
+        The values are sorted once and every threshold separating two consecutive values is evaluated, using
+        cumulative counts of the objects below it. The cutoff is placed midway between both values and, in
+        case of tie, the lowest one is chosen
+
+        Returns a tuple with the cutoff and the confusion matrix (TP, TN, FP, FN)
+    """
+    yb = np.asarray(yb, dtype=np.bool)
+    yp = np.asarray(yp, dtype=np.float64)
+
+    n = len(yp)
+    if n == 0:
+        return (0.0, (0,0,0,0))
+
+    order = np.argsort(yp, kind='mergesort')
+    ys = yp[order]
+    bs = yb[order]
+
+    npos = int(np.sum(bs))
+    nneg = n-npos
+
+    # k-th threshold classifies the objects 0 to k as negative. Classifying all the objects as positive
+    # is never better than classifying all of them as negative (last threshold), so it is not evaluated
+    FN = np.cumsum(bs)
+    TN = np.cumsum(~bs)
+    TP = npos-FN
+    FP = nneg-TN
+
+    sens = np.zeros(n,dtype=np.float64)
+    spec = np.zeros(n,dtype=np.float64)
+    if npos > 0 : sens = TP/float(npos)
+    if nneg > 0 : spec = TN/float(nneg)
+
+    diff = np.abs(sens-spec)
+
+    # thresholds between identical values are not possible
+    diff[:-1][ys[1:] <= ys[:-1]] = np.inf
+
+    k = int(np.argmin(diff))
+
+    if k < n-1:
+        cutoff = (ys[k]+ys[k+1])/2.0
+    else:
+        cutoff = ys[k]
+
+    return (float(cutoff), (int(TP[k]),int(TN[k]),int(FP[k]),int(FN[k])))
+
 def FourfoldDisplay(TP, TN, FP, FN, label, name, vpath):
     """ Draws confusion matrix graphical representaion
 
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+##    Description    eTOXlab columnar store of the training series data
+##
+##    Authors:       Manuel Pastor (manuel.pastor@upf.edu)
+##
+##    Copyright 2013 Manuel Pastor
+##
+##    This file is part of eTOXlab.
+##
+##    eTOXlab is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation version 3.
+##
+##    eTOXlab is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with eTOXlab.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from modelfile import saveModelFile, loadModelFile
+
+class tdatastore:
+    """Data extracted from the compounds of the training series, stored by columns: a single matrix with
+       the MD of all the compounds and arrays with their names, InChiKeys, charges, activities and positions
+       in tstruct.sdf
+
+       The rows are returned as the tuples (name, InChiKey, MD, charge, activity, position) used in the
+       tdata lists, so the store can replace them for reading. The MD of every row is a view of the matrix
+
+       The digest of the SDFile record of every compound (see molecule.getDigest) is also stored, if known,
+       for identifying the compounds in incremental builds
+    """
+
+    def __init__ (self, names, keys, X, lengths, charges, activities, positions, digests=None):
+        if digests is None:
+            digests = ['']*len(names)
+
+        self.digests = digests
+        self.names = names
+        self.keys = keys
+        self.X = X
+        self.lengths = lengths
+        self.charges = charges
+        self.activities = activities
+        self.positions = positions
+
+    def __len__ (self):
+        return len(self.names)
+
+    def __getitem__ (self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError ('tdatastore index out of range')
+
+        return (self.names[i], self.keys[i], self.X[i,:self.lengths[i]], self.charges[i],
+                self.activities[i], self.positions[i])
+
+    def __iter__ (self):
+        for i in range (len(self)):
+            yield self[i]
+
+    def isRectangular (self):
+        """Returns True if the MD of all the compounds have the same length
+        """
+        return len(self) == 0 or np.all(self.lengths == np.shape(self.X)[1])
+
+    def save (self, filename, settings):
+        """Saves the store to filename (see modelfile), together with the string "settings", which
+           describes how the data was obtained
+        """
+        saveModelFile (filename, 'tdata', {
+            'settings': np.frombuffer (settings, dtype=np.uint8),
+            'names': np.array (self.names, dtype=np.str_),
+            'keys': np.array (self.keys, dtype=np.str_),
+            'X': self.X, 'lengths': self.lengths,
+            'charges': self.charges, 'activities': self.activities, 'positions': self.positions,
+            'digests': np.array (self.digests, dtype=np.str_) })
+
+def storeRows (rows, digests=None):
+    """Returns a tdatastore containing the rows of a tdata list and, optionally, the list of digests of
+       their SDFile records
+    """
+
+    n = len(rows)
+
+    lengths = np.array([len(r[2]) for r in rows], dtype=np.int32)
+    ncol = 0
+    if n : ncol = int(np.max(lengths))
+
+    # MD shorter than the longest are padded with NaN
+    X = np.empty ((n,ncol), dtype=np.float64)
+    X.fill (np.nan)
+    for i, r in enumerate(rows):
+        X[i,:lengths[i]] = r[2]
+
+    activities = np.empty (n, dtype=np.float64)
+    for i, r in enumerate(rows):
+        try:
+            activities[i] = float(r[4])
+        except:
+            activities[i] = np.nan   # activity not found, in models without activity
+
+    return tdatastore ([str(r[0]) for r in rows],
+                       [str(r[1] or '') for r in rows],
+                       X, lengths,
+                       np.array([float(r[3]) for r in rows], dtype=np.float64),
+                       activities,
+                       np.array([int(r[5]) for r in rows], dtype=np.int32),
+                       digests)
+
+def loadStore (filename):
+    """Loads a store saved by tdatastore.save. The MD matrix is memory-mapped when large
+
+       Returns a tuple with the settings string and the store
+    """
+
+    m = loadModelFile (filename, 'tdata')
+
+    digests = None
+    if 'digests' in m:
+        digests = list(m['digests'])
+
+    store = tdatastore (list(m['names']), list(m['keys']), m['X'], m['lengths'],
+                        m['charges'], m['activities'], m['positions'], digests)
+
+    return (m['settings'].tostring(), store)
@@ -47,6 +47,17 @@ class imodel(model):
                                            
         self.experimental = False          # If set to True, and the input file contains a field with the label
                                            # described by 'SDFileExperimental' this value is returned
+
+        self.buildIncremental = False      # If set to True, when the model is built with a new series the compounds
+                                           # already present in the previous series, with identical structure and
+                                           # fields, reuse the MD extracted then, provided the normalization and MD
+                                           # settings did not change. Only new or modified compounds are processed
+
+        self.buildCheckpoint = 1000        # Number of compounds processed between checkpoints, which save the data
+                                           # extracted so far in the model directory. An interrupted build of the
+                                           # same series and settings is resumed after the last checkpoint. When
+                                           # set to 0 no checkpoint is saved. The errors found extracting the series
+                                           # are collected in build-error.log and added to error.log at the end
                                            
         ##########################################################################################################
         ##
@@ -191,6 +202,12 @@ class imodel(model):
                                             # before stop. The algorithm will run only until the model predictive
                                             # ability (assesed by cross-validation) will no longer improve
         
+        self.selVarStop = 0                 # If larger than 0, every GOLPE run stops before validating all the
+                                            # reduced models when the selection did not change after this number
+                                            # of successive blocks of 1/16 of the models (checked only after
+                                            # validating half of them). The reduced models are validated using
+                                            # 'numWorkers' processes
+        
         self.selVarMask = None              # Name of a file containing a previously computed mask of selected and
                                             # non selected variables
 
@@ -220,13 +237,14 @@ class imodel(model):
                                              # probability estimation.
 
           
-        ## Model Validation Settings
+        ## Model Validation Settings. PLS models support 'loo', 'kfold' and 'rkfold'
         
-        self.ModelValidationCV = 'loo'      ##      ('kfold', 'gkfold', 'stkfold', 'logo', 'lpgo', 'loo', 'lpo', 'shufsplit', 'gshufplit', 'stshufsplit', 'psplit', 'tsplit')
+        self.ModelValidationCV = 'loo'      ##      ('kfold', 'rkfold', 'gkfold', 'stkfold', 'logo', 'lpgo', 'loo', 'lpo', 'shufsplit', 'gshufplit', 'stshufsplit', 'psplit', 'tsplit')
         self.ModelValidationN = 2           ##       int, Only for n_splits or n_groups
-        self.ModelValidationP = 1           ##       int, Only for n_samples e.g. LeavePOut(p)
+        self.ModelValidationP = 1           ##       int, Only for n_samples e.g. LeavePOut(p), or number of repeats in rkfold
 
                                             ##        kfold = KFold(n_splits=2, random_state=self.random_state, shuffle=False)              ### K-Folds cross-validator
+                                            ##        rkfold = RepeatedKFold(n_splits=2, n_repeats=1, random_state=self.random_state)       ### Repeated K-Folds cross-validator
                                             ##        gkfold = GroupKFold(n_splits=2)                                                       ### K-fold iterator variant with non-overlapping groups.
                                             ##        stkfold = StratifiedKFold(n_splits=2, random_state=self.random_state, shuffle=False)  ### Stratified K-Folds cross-validator
                                             ##        logo = LeaveOneGroupOut()                                                             ### Leave One Group Out cross-validator
@@ -296,6 +314,61 @@ class imodel(model):
         self.plotBGMarkerSize = 20          # Size of the marker
         self.plotBGMarkerLine = 0           # Thickness of the marker border
 
+        ##########################################################################################################
+        ##
+        ## Parallel processing settings
+        ##
+        ##    Define how many processes are used to normalize the structures and compute the molecular
+        ##    descriptors, and to cross-validate PLS models. Every process runs the external programs in a
+        ##    private directory
+        ##
+        ##########################################################################################################
+        self.numWorkers = 1                 # Number of processes used to process the compounds and to predict the
+                                            # PLS cross-validation sets. When set to 1 everything runs in sequence
+
+        self.toolChunk = 1                  # Number of compounds sent together to every external program (blabber,
+                                            # corina, pentacle, padel and adriana). When set to 1 the programs are
+                                            # called once for every compound
+
+        ##########################################################################################################
+        ##
+        ## Cache settings
+        ##
+        ##    The normalized structures and the MD computed by the external programs are stored in caches, shared
+        ##    by all the models of this computer, and reused when the same structure is processed again with the
+        ##    same settings
+        ##
+        ##########################################################################################################
+        self.cacheNorm = True               # If True the normalized structures and their formal charge are stored
+                                            # in the cache and obtained from it. The cache is never used by
+                                            # confidential models, nor when this file overrides the normalization
+                                            # methods. False by default
+
+        self.cacheMD = True                 # If True the MD are stored in the cache and obtained from it. The
+                                            # cache is never used by confidential models, nor when this file
+                                            # overrides the methods computing the MD. False by default
+
+        self.cachePath = '/var/tmp/etoxlab-cache'   # Directory where the cache is stored
+
+        self.cacheSize = 1000               # Maximum size of every cache in MB. When exceded, the entries used less
+                                            # recently are removed
+
+        ##########################################################################################################
+        ##
+        ## Timeouts of external programs
+        ##
+        ##    Maximum time (in seconds) allowed to every external program for processing a single compound. When
+        ##    the compounds are processed in chunks (see toolChunk) the time is multiplied by the number of
+        ##    compounds. Programs still running after this time are killed and the compound is reported as an
+        ##    error. None waits forever
+        ##
+        ##########################################################################################################
+        self.mokaTimeout = 60
+        self.corinaTimeout = 60
+        self.adrianaTimeout = 120
+        self.pentacleTimeout = 600
+        self.padelTimeout = 600
+
         ##########################################################################################################
         ##
         ## Path to external programs
@@ -306,7 +379,7 @@ class imodel(model):
         ##########################################################################################################                                            
         self.mokaPath = '/opt/blabber/blabber4eTOX/'
         self.padelPath = '/opt/padel/padel218ws/'
-        self.padelURL = 'http://localhost:9000/computedescriptors?params=' 
+        self.padelURL = 'http://localhost:9000/computedescriptors?params='   # or a list of URLs of several servers
         self.pentaclePath = '/opt/pentacle/pentacle106eTOX/'
         self.adrianaPath = '/opt/AdrianaCode/AdrianaCode226/'
         self.corinaPath = '/opt/corina/corina3494/'
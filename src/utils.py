@@ -27,6 +27,9 @@ import string
 import random
 import time
 import subprocess
+import tempfile
+import signal
+import threading
 import cPickle as pickle
 
 
@@ -92,6 +95,111 @@ def splitSDF (molecules):
 
     return molList
 
+def readSDF (f):
+    """Iterates over the molecules of the SDFile opened as f, without writing them to files
+
+       Every molecule is returned as a string, including the '$$$$' line. Any text after the
+       last '$$$$' line is ignored
+    """
+
+    block = []
+
+    for line in f:
+        block.append(line)
+
+        if "$$$$" in line:
+            yield ''.join(block)
+            block = []
+
+def appendFile (source, target, offset=0):
+    """Appends the content of file "source", from byte "offset", to file "target", which is created if
+       it does not exist. A missing source is taken as empty
+
+       Returns the size of source
+    """
+
+    fo = open (target,'ab')
+    try:
+        if not os.path.isfile (source):
+            return offset
+
+        fi = open (source,'rb')
+        fi.seek (offset)
+        shutil.copyfileobj (fi, fo)
+        size = fi.tell()
+        fi.close()
+    finally:
+        fo.close()
+
+    return size
+
+def enumerateChunks (items, size, first=1):
+    """Iterates over the elements of "items" in lists of "size" elements (the last one could be shorter)
+
+       Every list is returned together with the position of its first element, starting at "first"
+    """
+
+    chunk = []
+
+    for item in items:
+        chunk.append(item)
+
+        if len(chunk) == size:
+            yield (first, chunk)
+            first += size
+            chunk = []
+
+    if chunk:
+        yield (first, chunk)
+
+def scratchDir ():
+    """Creates a private directory for the temporary files of a single workflow run and returns its name
+
+       A memory-backed filesystem (/dev/shm) is used when available, to avoid creating and removing
+       many small files in the working directory, which can be slow on network filesystems
+    """
+
+    tmpfs = '/dev/shm'
+    if os.path.isdir(tmpfs) and os.access(tmpfs, os.W_OK):
+        return tempfile.mkdtemp(prefix='etoxlab-', dir=tmpfs)
+
+    return tempfile.mkdtemp(prefix='etoxlab-')
+
+
+def callTimeout (call, timeout, stdout=None, stderr=None, cwd=None):
+    """Runs the command "call" like subprocess.call, but kills it, together with all the processes it
+       started, if it is still running after "timeout" seconds. When timeout is None it waits forever
+
+       Returns the exit code of the command or None if it was killed
+    """
+
+    # the command is run in a new process group, which is killed as a whole
+    proc = subprocess.Popen (call, stdout=stdout, stderr=stderr, cwd=cwd, preexec_fn=os.setsid)
+
+    killed = []
+    def kill ():
+        try:
+            os.killpg (proc.pid, signal.SIGKILL)
+            killed.append (True)
+        except OSError:
+            pass                  # finished in the meantime
+
+    timer = None
+    if timeout:
+        timer = threading.Timer (timeout, kill)
+        timer.start()
+
+    try:
+        retcode = proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+
+    # the group can also be killed after the command exited, before it was reaped, which is no timeout
+    if killed and retcode == -signal.SIGKILL:
+        return None
+
+    return retcode
 
 def getExternalPrediction (tag, molecules):
     
@@ -283,13 +391,17 @@ def nextVersion (endpoint):
 
     return epd
 
-def cleanSandbox (sandDir):
+def cleanSandbox (sandDir, keep=[]):
+    """Removes the files of the model built in sandDir, except those listed in "keep"
+    """
 
     if not sandDir.endswith('/'):
         sandDir+='/'
         
     files = ['tstruct.sdf',
+             'tdata.npz',
              'tdata.pkl',
+             'tindex.pkl',
              'info.pkl',
              'ffdexcluded.pkl',
              'view-property.pkl',
@@ -298,7 +410,8 @@ def cleanSandbox (sandDir):
              'view-background-property.txt']
         
     for f in files:
-        removefile (sandDir+f)
+        if f not in keep:
+            removefile (sandDir+f)
 
 def updateProgress(progress):
     """Prints a progress bar in the screen.
@@ -323,6 +436,19 @@ def updateProgress(progress):
     sys.stdout.write(text)
     sys.stdout.flush()
     
+errorFile = './error.log'     # file where writeError appends the messages
+
+def getErrorFile ():
+    """Returns the name of the file where writeError appends the messages
+    """
+    return errorFile
+
+def setErrorFile (name):
+    """Makes writeError append the messages to file "name"
+    """
+    global errorFile
+    errorFile = name
+
 def writeError (error, verbose=False):
     """Print an error message"""
 
@@ -330,7 +456,7 @@ def writeError (error, verbose=False):
         print error
         
     try:
-        f=open('./error.log','a+')
+        f=open(errorFile,'a+')
     except:
         return
     